@@ -10,13 +10,17 @@ abbr note:
     val: value
     var: variant
 """
-from os.path import abspath, exists
+from concurrent.futures import ProcessPoolExecutor
+from os.path import abspath, exists, getsize
 
 from lk_utils import file_sniffer
 from lk_utils.lk_logger import lk
 
 from src.module_analyser import ModuleHelper
+from src.parse_cache import ParseCache
 from src.pyfile_analyser import PyfileAnalyser
+from src.symbol_table import SymbolTable
+from src.worklist import Worklist
 from src.writer import Writer
 
 
@@ -27,55 +31,279 @@ class VirtualRunner:
     docs: docs/call flow 实现方案.txt
     """
     
-    def __init__(self, prjdir, pyfile):
+    def __init__(self, prjdir, pyfile, cache_dir=None, workers=1,
+                 order='bfs', priority='dir', snapshot_file=None,
+                 lazy_discovery=False, view_mode='tree', max_depth=None,
+                 max_fanout=None, collapse_cycles=False,
+                 cascade_file='../temp/out.json',
+                 tile_file='../temp/out2.json', edge_file=None,
+                 graph_file=None):
+        """
+        ARGS:
+            prjdir
+            pyfile
+            cache_dir: None/str. 解析缓存的目录, 为 None 时不使用缓存. 详见 src
+                .parse_cache.ParseCache.
+            workers: int. 并行分析 pyfile 的进程数. 小于等于 1 时在当前进程中逐个分析.
+                并行与否不影响输出结果.
+            order, priority: 新发现的 pyfile 的分析顺序. 详见 src.worklist
+                .Worklist.
+            snapshot_file: None/str. 项目扫描快照的保存路径. 详见 src.prj_scanner
+                .PrjSnapshot.
+            lazy_discovery: bool. 不预先扫描 prjdir, 按需发现项目模块. 详见 src
+                .module_index.LazyModuleIndex.
+            view_mode, max_depth, max_fanout, collapse_cycles: 层叠视图的模式和截
+                断方式. 详见 src.writer.Writer.
+            cascade_file, tile_file: 层叠视图和平铺视图的输出路径. 详见 src.writer
+                .Writer.
+            edge_file: None/str. 实时输出调用关系的 NDJSON 文件. 详见 src.edge_sink
+                .EdgeSink.
+            graph_file: None/str. 调用图的二进制文件. 详见 src.writer.Writer.
+        """
         self.prjdir = prjdir
         self.pyfile = pyfile
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.order = order
+        self.priority = priority
         
-        self.module_helper = ModuleHelper(prjdir)
-        self.pyfile_analyser = PyfileAnalyser(self.module_helper)
-        self.writer = Writer()
+        self.module_helper = ModuleHelper(
+            prjdir, snapshot_file=snapshot_file, lazy=lazy_discovery
+        )
+        self.parse_cache = ParseCache(cache_dir) if cache_dir else None
+        self.pyfile_analyser = PyfileAnalyser(
+            self.module_helper, self.parse_cache
+        )
+        self.symbols = SymbolTable()
+        self.writer = Writer(self.symbols, view_mode, max_depth, max_fanout,
+                             collapse_cycles, cascade_file, tile_file,
+                             edge_file, graph_file)
     
     def main(self):
-        call_stream = [self.pyfile]
+        call_stream = Worklist(self.order, self.priority)
+        
+        if self.workers > 1:
+            executor = ProcessPoolExecutor(
+                self.workers, initializer=_init_worker,
+                initargs=(self.module_helper, self.cache_dir)
+            )
+        else:
+            executor = None
+        futures = {}  # format: {pyfile: Future}
         
-        for pyfile in call_stream:
-            lk.logdx(pyfile, style='◆')
+        def submit(pyfile_):
+            if executor:
+                futures[pyfile_] = executor.submit(_run_worker, pyfile_)
+        
+        try:
+            call_stream.push(self.pyfile)
+            submit(self.pyfile)
             
-            module_calls, prj_modules = self.pyfile_analyser.main(pyfile)
-            """
-            module_calls: {module1: [call1, call2, ...], ...}
-            prj_modules: [prj_module1, prj_module2, ...]
-            """
+            while call_stream:
+                pyfile, wave = call_stream.pop()
+                lk.logdx(pyfile, style='◆')
+                
+                if executor:
+                    # 按 call_stream 的顺序取回结果, 使 writer 的记录顺序与逐个分析时一致.
+                    module_calls, prj_modules, cache_stats = \
+                        futures.pop(pyfile).result()
+                    if self.parse_cache:
+                        self.parse_cache.merge_stats(cache_stats)
+                else:
+                    module_calls, prj_modules = self.pyfile_analyser.main(
+                        pyfile
+                    )
+                """
+                module_calls: {module1: [call1, call2, ...], ...}
+                prj_modules: [prj_module1, prj_module2, ...]
+                """
 
-            # ------------------------------------------------
-            
-            for module, calls in module_calls.items():
-                lk.loga(module, len(calls), calls)
-                self.writer.record(module, calls)
+                # ------------------------------------------------
+                
+                for module, calls in module_calls.items():
+                    lk.loga(module, len(calls), calls)
+                    self.writer.record(module, calls)
+                self.writer.finish_file(pyfile)
 
-            # ------------------------------------------------
-            
-            new_pyfiles = self.get_new_pyfiles(prj_modules)
-            for i in new_pyfiles:
-                if i not in call_stream:
-                    call_stream.append(i)
+                # ------------------------------------------------
+                
+                new_pyfiles = self.get_new_pyfiles(prj_modules)
+                for i in new_pyfiles:
+                    if call_stream.push(i, wave + 1):
+                        submit(i)
+        finally:
+            if executor:
+                executor.shutdown()
+                if self.parse_cache:
+                    self.parse_cache.refresh()
         
         # calc elapsed time
         lk.total_count = lk.counter
         
+        lk.logt('[I1527]', call_stream.get_stats())
+        if self.parse_cache:
+            lk.logt('[I1532]', self.parse_cache.get_stats())
+        
         # TEST
         self.writer.show(
             self.module_helper.get_module_by_filepath(
                 self.pyfile
             ) + '.module'
         )
+        self.writer.close()
     
     def get_new_pyfiles(self, prj_modules):
         return [self.module_helper.get_pyfile_by_prj_module(x)
                 for x in prj_modules]
+
+
+class ScopeRunner(VirtualRunner):
+    """
+    按需分析的虚拟运行机.
+    
+    VirtualRunner 会分析每个被发现的 pyfile 中的所有 module (函数, 类的作用域). 而
+    ScopeRunner 以 module 为单位调度: 从启动文件的 runtime_module 出发, 只分析实际被调用
+    到的 module, 并在首次调用到某个 pyfile 中的 module 时才加载该 pyfile.
+    
+    由于层叠视图只会经过从 runtime_module 可达的 module, 两者输出的层叠视图相同, 而本类
+    输出的平铺视图是 VirtualRunner 的子集.
+    
+    注: 本类逐个分析 module, 不使用 workers 参数.
+    
+    data format:
+        self.module_analysers: {prj_module: ModuleAnalyser}. 已加载的 pyfile.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.module_analysers = {}
+    
+    def main(self):
+        call_stream = Worklist(self.order, self.get_priority())
+        get_id = self.symbols.get_id
+        
+        runtime_module = self.module_helper.get_module_by_filepath(
+            self.pyfile
+        ) + '.module'
+        call_stream.push(get_id(runtime_module))
+        
+        analysed = 0
+        
+        while call_stream:
+            module_id, wave = call_stream.pop()
+            module = self.symbols.get_name(module_id)
+            
+            prj_module = self.module_helper.get_prj_module(module)
+            if not prj_module or prj_module == module:
+                # 外部模块, 或者是 pyfile 本身 (而非其中的 module).
+                continue
+            module_analyser = self.get_module_analyser(prj_module)
+            if module not in module_analyser.module_linos:
+                # 不是一个作用域. 例如类的属性.
+                continue
+            
+            lk.logdx(module, style='◆')
+            calls = module_analyser.analyse_scope(module)
+            analysed += 1
             
+            lk.loga(module, len(calls), calls)
+            self.writer.record(module, calls)
             
-def main(prjdir, pyfile):
+            for call in calls:
+                call_stream.push(get_id(call), wave + 1)
+        
+        # calc elapsed time
+        lk.total_count = lk.counter
+        
+        lk.logt('[I1527]', call_stream.get_stats())
+        lk.logt('[I1541]', {
+            'pyfiles' : len(self.module_analysers),
+            'analysed': analysed,
+            'defined' : sum(len(x.module_linos)
+                            for x in self.module_analysers.values()),
+        })
+        if self.parse_cache:
+            lk.logt('[I1532]', self.parse_cache.get_stats())
+        
+        # TEST
+        self.writer.show(runtime_module)
+        self.writer.close()
+    
+    def get_priority(self):
+        """
+        工作表中的元素是 module 的 id (see src.symbol_table.SymbolTable) 而不是
+        pyfile, 因此 priority 模式下的键要改为作用于 id:
+            'dir': 按 module 名排序, 使同一 pyfile 中的 module 被连续分析.
+            'size': 按 module 所在 pyfile 的大小排序. 外部模块的键为 0.
+            callable: 接收 module 名 (而非 pyfile) 并返回可比较的键.
+        
+        OT: str/callable. 传给 src.worklist.Worklist 的 priority.
+        """
+        get_name = self.symbols.get_name
+        if self.priority == 'dir':
+            return get_name
+        if self.priority == 'size':
+            def get_size(module_id):
+                prj_module = self.module_helper.get_prj_module(
+                    get_name(module_id)
+                )
+                if not prj_module:
+                    return 0
+                return getsize(
+                    self.module_helper.get_pyfile_by_prj_module(prj_module)
+                )
+            
+            return get_size
+        if callable(self.priority):
+            return lambda module_id: self.priority(get_name(module_id))
+        return self.priority  # 由 Worklist 报告无效的值
+    
+    def get_module_analyser(self, prj_module):
+        module_analyser = self.module_analysers.get(prj_module)
+        if module_analyser is None:
+            module_analyser = self.pyfile_analyser.prepare(
+                self.module_helper.get_pyfile_by_prj_module(prj_module)
+            )
+            self.module_analysers[prj_module] = module_analyser
+        return module_analyser
+
+
+# ------------------------------------------------ process pool workers
+
+_worker = None  # type: PyfileAnalyser
+
+
+def _init_worker(module_helper, cache_dir):
+    """
+    每个子进程启动时调用一次. module_helper 由主进程传入, 避免每个子进程重复扫描 prjdir.
+    """
+    global _worker
+    parse_cache = ParseCache(cache_dir) if cache_dir else None
+    _worker = PyfileAnalyser(module_helper, parse_cache)
+
+
+def _run_worker(pyfile):
+    """
+    OT: (module_calls, prj_modules, cache_stats)
+            cache_stats: dict. 本次调用中 parse_cache 计数器的增量, 由主进程汇总.
+    """
+    parse_cache = _worker.parse_cache
+    before = parse_cache.get_stats() if parse_cache else None
+    module_calls, prj_modules = _worker.main(pyfile)
+    if parse_cache:
+        after = parse_cache.get_stats()
+        cache_stats = {
+            k: after[k] - before[k] for k in ('hits', 'misses', 'evictions')
+        }
+    else:
+        cache_stats = None
+    return module_calls, prj_modules, cache_stats
+
+
+def main(prjdir, pyfile, cache_dir=None, workers=1, order='bfs',
+         engine='file', view_mode='tree', max_depth=None, max_fanout=None,
+         collapse_cycles=False, cascade_file='../temp/out.json',
+         tile_file='../temp/out2.json', edge_file=None, graph_file=None):
     """
     假设测试项目为 testflight, 启动文件为 testflight/test_app_launcher.py.
     项目结构为:
@@ -91,6 +319,27 @@ def main(prjdir, pyfile):
         exclude_dirs: None/iterable. 设置要排除的目录, 目前仅被用于 src.analyser
             .ModuleAnalyser#get_project_modules() (原本是想提升初始化效率, 实际提升不
             大). 未来会考虑移除该参数.
+        cache_dir: None/str. 解析缓存的目录. e.g. '../temp/parse_cache/'. 为
+            None 时不使用缓存.
+        workers: int. 并行分析 pyfile 的进程数, 默认为 1 (不并行).
+        order: str. 'bfs'/'dfs'/'priority'. pyfile 的分析顺序, 详见 src
+            .worklist.Worklist.
+        engine: str. 'file'/'scope'. 'file' 分析被发现的 pyfile 中的所有 module,
+            'scope' 只分析从启动文件可达的 module, 详见 ScopeRunner.
+        view_mode: str. 'tree'/'dag'. 层叠视图的模式, 'dag' 模式下重复的子树只展开
+            一次. 详见 src.writer.Writer.
+        max_depth: None/int. 层叠视图的最大深度, 为 None 时不限制.
+        max_fanout: None/int. 层叠视图中每个 module 最多展开的被调用者的数量, 为 None
+            时不限制.
+        collapse_cycles: bool. 把互相调用的 module 合并为一个节点, 在无环的缩点上展开层
+            叠视图. 详见 src.condensation.Condensation.
+        cascade_file, tile_file: None/str. 层叠视图和平铺视图的输出路径, 以 '.gz' 结
+            尾时以 gzip 压缩, 为 None 时不输出. 层叠视图以流的方式写入, 不在内存中构
+            建.
+        edge_file: None/str. 在分析的过程中实时输出调用关系的 NDJSON 文件, e.g.
+            '../temp/edges.ndjson'. 为 None 时不输出. 详见 src.edge_sink.EdgeSink.
+        graph_file: None/str. 分析结束后保存调用图的二进制文件, e.g. '../temp
+            /graph.bin'. 可作为 `python -m src.path_query` 的输入. 为 None 时不保存.
     OT:
     """
     assert exists(prjdir) and exists(pyfile)
@@ -101,7 +350,22 @@ def main(prjdir, pyfile):
     # '../testflight/test_app_launcher.py'
     # -> 'D:/myprj/testflight/test_app_launcher.py'
     
-    runner = VirtualRunner(prjdir, pyfile)
+    if engine == 'file':
+        runner = VirtualRunner(prjdir, pyfile, cache_dir, workers, order,
+                               view_mode=view_mode, max_depth=max_depth,
+                               max_fanout=max_fanout,
+                               collapse_cycles=collapse_cycles,
+                               cascade_file=cascade_file, tile_file=tile_file,
+                               edge_file=edge_file, graph_file=graph_file)
+    elif engine == 'scope':
+        runner = ScopeRunner(prjdir, pyfile, cache_dir, order=order,
+                             view_mode=view_mode, max_depth=max_depth,
+                             max_fanout=max_fanout,
+                             collapse_cycles=collapse_cycles,
+                             cascade_file=cascade_file, tile_file=tile_file,
+                             edge_file=edge_file, graph_file=graph_file)
+    else:
+        raise ValueError('the `engine` must be "file" or "scope"')
     runner.main()
 
 
@@ -1,21 +1,18 @@
 from lk_utils.lk_logger import lk
 
+from src.ast_analyser import AstTable, FUNCTION_DEF
 from src.line_parser import LineParser
 
 
 class AssignAnalyser:
     
-    def __init__(self, module_helper, ast_tree, ast_indents):
+    def __init__(self, module_helper, ast_table: AstTable):
         self.module_helper = module_helper
-        self.ast_tree = ast_tree
-        self.ast_indents = ast_indents
-        
-        self.max_lino = max(ast_indents.keys())
-        lk.loga(self.max_lino)
+        self.ast_table = ast_table
         
         self.top_linos = [
-            lino for lino, indent in ast_indents.items()
-            if indent == 0
+            lino for lino in ast_table.linos
+            if ast_table.get_indent(lino) == 0
         ]
         
         self.top_module = module_helper.get_top_module()
@@ -24,6 +21,9 @@ class AssignAnalyser:
         # 'testflight.parser.Parser', 'main': 'testflight.app.main', 'Init':
         # 'testflight.app.Init'}
         lk.loga(self.top_assigns)
+        
+        self.scope_modules = ast_table.scopes.get_modules(self.top_module)
+        self.module_scopes, self.scope_vars = self.indexing_scope_vars()
     
     def find_global_vars(self):
         """
@@ -35,14 +35,10 @@ class AssignAnalyser:
         IN: module_linos: provided by src.module_analyser.ModuleIndexing
                 #indexing_module_linos
             self.module_helper
-            self.ast_tree
-            self.ast_indents
+            self.ast_table
         OT: dict. {var: module}
         """
-        top_linos = tuple(
-            lino for lino, indent in self.ast_indents.items()
-            if indent == 0
-        )
+        top_linos = tuple(self.top_linos)
         lk.logt('[D3743]', self.top_module, top_linos)
         
         # ------------------------------------------------
@@ -51,116 +47,89 @@ class AssignAnalyser:
         line_parser = LineParser(self.top_module)
         
         for lino in top_linos:
-            ast_line = self.ast_tree[lino]
-            lk.logt('[TEMPRINT]_20190811_214127', lino, ast_line)
-            line_parser.main(ast_line)
-            # line_parser 会自动帮我们处理 ast_line 涉及的 Import, ImportFrom,
-            # Assign 等的变量与 module 的对照关系.
+            program = self.ast_table.get_program(lino)
+            lk.logt('[TEMPRINT]_20190811_214127', lino, program)
+            line_parser.run(program)
+            # line_parser 会自动帮我们处理该行涉及的 Import, ImportFrom, Assign
+            # 等的变量与 module 的对照关系.
         
         # ------------------------------------------------
         # 行内的 `global xxx`
         
-        for lino in self.ast_indents:
+        for lino in self.ast_table.linos:
             if lino in top_linos:
                 continue
             pass  # TODO
         
         return line_parser.get_vars()
     
-    def indexing_assign_reachables(
-            self, target_module, module_linos
-    ):
+    def indexing_scope_vars(self):
+        """
+        自下而上地为每个作用域建立符号表, 再沿父链串起每个作用域可见的符号表.
+        
+        可见规则 (参照 python 的 LEGB):
+            1. 作用域内直接定义的函数和类.
+            2. 外层函数作用域中可见的变量 (闭包).
+            3. 外层类作用域中定义的名字对其内部的方法不可见, 例如方法中的 `main` 指向的是
+               全局的 main, 而不是同一个类中的另一个方法.
+            模块层的变量 (global vars) 由 self.top_assigns 提供, 不在此处重复收录.
+        
+        IN: self.ast_table.scopes
+            self.scope_modules
+        OT: (A, B)
+                A: {module: scope}. module 对应的作用域下标. 当 AClass 与 AClass
+                    .__init__ 同名时, 取 AClass.
+                B: [var_reachables, ...]. 与作用域下标一一对应.
+                    var_reachables: (frame, ...). 由外到内排列, 相同的外层符号表被
+                        各子作用域共享而不复制.
+                        frame: {var: module}. e.g. {'child_method': 'src.app
+                            .main.child_method'}
+        """
+        scopes = self.ast_table.scopes
+        modules = self.scope_modules
+        
+        module_scopes = {}
+        for scope, module in enumerate(modules):
+            module_scopes.setdefault(module, scope)
+        
+        # 每个作用域自身的符号表, 即它直接包含的函数和类. 同名时后定义的覆盖先定义的.
+        symbols = [{} for _ in modules]
+        for scope, parent in enumerate(scopes.parents):
+            if parent != -1:
+                symbols[parent][scopes.names[scope]] = modules[scope]
+        
+        scope_vars = []
+        visibles = []  # 作用域向其内部的作用域开放的符号表
+        for scope, parent in enumerate(scopes.parents):
+            outer = visibles[parent] if parent != -1 else ()
+            frames = outer + (symbols[scope],)
+            scope_vars.append(frames)
+            visibles.append(
+                frames if scopes.kinds[scope] == FUNCTION_DEF else outer
+            )
+        
+        return module_scopes, scope_vars
+    
+    def indexing_assign_reachables(self, target_module):
         """
         IN: target_module: str. 'src.app.Init.main'
-            module_linos
-        OT: (<dict var_reachables>, <str parent_module>)
+        OT: (<tuple var_reachables>, <str parent_module>)
+                var_reachables: (frame, ...). 只读. 模块层的变量不在其中, 由
+                    LineParser 的 global_vars (即 self.top_assigns) 提供.
+                parent_module: str. 父作用域的 module, 顶层作用域为空字符串. e.g.
+                    'src.app.Init'
         """
         if self.module_helper.is_runtime_module(target_module):
-            # 相当于返回 self.find_global_vars() 的结果.
-            return self.top_assigns.copy(), ''
+            return (), ''
         
-        if target_module not in module_linos:
-            lk.logt('[E2459]', target_module, module_linos)
+        scope = self.module_scopes.get(target_module)
+        if scope is None:
+            lk.logt('[E2459]', target_module, tuple(self.module_scopes))
             raise Exception
-
-        lk.logt('[I0114]', target_module)
-        
-        # ------------------------------------------------
-        
-        """
-        workflow:
-            1. 以 target_module 的 linos[0] 为起点, 向前找到第一个 indent 为 0 的
-            lino
-            2. 以 target_module 的 linos[-1] 为起点, 向后找到第一个 indent 为 0 的
-            lino
-            3. 在此区间内, 将所有 ast_defs 进行解析, 并认定为 var_reachables
-        """
-        
-        # ------------------------------------------------ lino reachables
-        
-        target_linos = module_linos[target_module]
-        curr_module_lino = target_linos[0]
-        start_offset, end_offset = target_linos[0], target_linos[-1] + 1
-        
-        # the start lino reachable
-        indent = self.ast_indents[start_offset]
-        # lk.logt('[TEMPRINT]20190811182309', target_module, start_offset,
-        #         indent)
-        if indent == 0:
-            parent_module = ''
-        else:
-            while True:
-                parent_module = self.module_helper.get_parent_module(
-                    target_module
-                )
-                # lk.logt('[TEMPRINT]20190811182549', target_module,
-                #         parent_module)
-                parent_linos = module_linos[parent_module]
-                start_offset, end_offset = parent_linos[0], parent_linos[-1] + 1
-                parent_indent = self.ast_indents[start_offset]
-                if parent_indent == 0:
-                    break
-                else:
-                    continue
-            # -> parent_module = 'src.app.Init'
-        
-        # the end lino reachable
-        while end_offset < self.max_lino:
-            if end_offset in self.ast_indents:
-                indent = self.ast_indents[end_offset]
-                if indent == 0:
-                    break
-            end_offset += 1
-        
-        # get lino reachalbes
-        lino_reachables = [
-            lino
-            for lino in range(start_offset, end_offset)
-            if lino in self.ast_indents and lino != curr_module_lino
-        ]
-        """
-        这里为什么要判断 `lino != curr_module_lino`?
-        因为 target_module 不能指任自身, 所以应去除.
-        例如 target_module = 'src.app.module', 在源码中, 不能因此自动产生 `module:
-        src.app.module` 的对应关系. 所以不能加入到 assigns 中.
-        """
-        
-        # parse vars
-        line_parser = LineParser(self.top_module)
         
-        ast_defs = ("<class '_ast.FunctionDef'>", "<class '_ast.ClassDef'>")
+        lk.logt('[I0114]', target_module)
         
-        for lino in lino_reachables:
-            ast_line = self.eval_ast_line(lino)
-            if ast_line[0] in ast_defs:
-                line_parser.main(ast_line)
+        parent = self.ast_table.scopes.parents[scope]
+        parent_module = self.scope_modules[parent] if parent != -1 else ''
         
-        return line_parser.get_vars(), parent_module
-    
-    def eval_ast_line(self, lino):
-        ast_line = self.ast_tree[lino]  # type: list
-        # ast_line is type of list, assert it not empty.
-        assert ast_line
-        # here we only take its first element. which will show us method or
-        # class definitions.
-        return ast_line[0]
+        return self.scope_vars[scope], parent_module
@@ -1,9 +1,321 @@
-import re
-
+import _ast
 from _ast import *
-from ast import parse as ast_parse, walk as ast_walk
+from array import array
+from ast import iter_child_nodes, parse as ast_parse
+from bisect import bisect_right
+from collections import deque
+from sys import intern
+
+# AstAnalyser 的输出格式 (AstTable, NODE_KINDS, eval_node 的取值规则等) 发生变化时, 请将
+# 它加一, 以使 src.parse_cache.ParseCache 中的旧缓存失效.
+ANALYSER_VERSION = 3
+
+# ------------------------------------------------ node kinds
+
+"""
+节点类型编码 (node kind): 用小整数代替 "<class '_ast.Call'>" 这样的类型字符串, 使分发和比
+较都变成整数操作.
+本程序会处理的类型使用下面固定的编码, 其余 _ast 类型按名称排序后依次编码. 调试时可通过
+KIND_NAMES[kind] 还原出类型名.
+"""
+OTHER = 0
+ARG = 1
+ASSIGN = 2
+ATTRIBUTE = 3
+CALL = 4
+CLASS_DEF = 5
+FUNCTION_DEF = 6
+IMPORT = 7
+IMPORT_FROM = 8
+
+NODE_KINDS = {  # format: {ast_class: kind}
+    arg        : ARG,
+    Assign     : ASSIGN,
+    Attribute  : ATTRIBUTE,
+    Call       : CALL,
+    ClassDef   : CLASS_DEF,
+    FunctionDef: FUNCTION_DEF,
+    Import     : IMPORT,
+    ImportFrom : IMPORT_FROM,
+}
+for _cls in sorted(
+        (x for x in vars(_ast).values()
+         if isinstance(x, type) and issubclass(x, AST)),
+        key=lambda x: x.__name__
+):
+    if _cls not in NODE_KINDS:
+        NODE_KINDS[_cls] = len(NODE_KINDS) + 1
+del _cls
+
+KIND_NAMES = ('',) + tuple(  # format: (name, ...), the index is the kind.
+    cls.__name__ for cls, _ in sorted(NODE_KINDS.items(), key=lambda x: x[1])
+)
+
+
+# ------------------------------------------------ line programs
+
+"""
+行程序 (line program): 把一行的 [(kind, val), ...] 预先编译为指令序列, 由 src
+.line_parser.LineParser#run() 解释执行. 字符串切分, 'self.' 前缀判断等与变量无关的工
+作在编译时完成一次, 执行时只剩下变量查找和字符串拼接.
+
+指令格式为元组, 第一个元素是操作码:
+    (OP_RESOLVE, head, suffix): 查找 head 对应的 module, 返回 module + suffix.
+        e.g. 'downloader.Downloader' -> ('downloader', '.Downloader')
+    (OP_ASSIGN, new_var, head, suffix): 查找 head, 并将结果赋给 new_var.
+    (OP_ARG, arg): 函数的参数.
+    (OP_DEFINE, var, suffix): 函数或类的定义, suffix 为 '.' + var.
+    (OP_IMPORT, var, module): 导入.
+不产生任何效果的节点 (如 Name, Str 等) 不会被编译.
+"""
+OP_RESOLVE = 1
+OP_ASSIGN = 2
+OP_ARG = 3
+OP_DEFINE = 4
+OP_IMPORT = 5
+
+
+def compile_line(ast_line) -> tuple:
+    """
+    IN: ast_line: [(kind, val), ...]
+    OT: program: ((op, ...), ...)
+    """
+    program = []
+    for kind, val in ast_line:
+        if kind == ATTRIBUTE or kind == CALL:
+            # Attribute 和 Call 的解析方式相同. 'self.main' 也按 head = 'self' 处理.
+            head, dot, tail = val.partition('.')
+            program.append((OP_RESOLVE, head, dot + tail))
+        elif kind == ASSIGN:
+            # val: {new_var: known_var}. e.g. {'init': 'Init'}
+            for new_var, known_var in val.items():
+                if known_var.startswith('self.'):
+                    # 'self.main' -> 'src.app.Init' + '.main'
+                    program.append((OP_ASSIGN, new_var, 'self', known_var[4:]))
+                else:
+                    # 'downloader.Downloader' -> 'testflight.downloader'. 注意这
+                    # 里只取 head 对应的 module.
+                    program.append((OP_ASSIGN, new_var,
+                                    known_var.split('.', 1)[0], ''))
+        elif kind == ARG:
+            program.append((OP_ARG, val))
+        elif kind == FUNCTION_DEF or kind == CLASS_DEF:
+            program.append((OP_DEFINE, val, '.' + val))
+        elif kind == IMPORT or kind == IMPORT_FROM:
+            # val: {module: var}. e.g. {'lk_utils.lk_logger.lk': 'lk'}
+            for module, var in val.items():
+                program.append((OP_IMPORT, var, module))
+    return tuple(program)
+
+
+class AstTable:
+    """
+    以行号为下标的紧凑 ast 行表 (struct-of-arrays).
+    
+    data format:
+        kinds: array('B'). 所有节点的类型编码, 按行号升序, 同一行内按 ast_walk 的顺序.
+        vals: list. 与 kinds 一一对应的节点值, str/dict. 其中的字符串都已 intern.
+        offsets: array('I'). 长度为 max_lino + 2. 第 lino 行的节点位于 kinds[offsets[
+            lino]:offsets[lino + 1]], 没有节点的行为空区间.
+        indents: array('h'). 长度为 max_lino + 1. 第 lino 行的缩进, 没有节点的行为 -1.
+        linos: array('I'). 所有含节点的行号, 升序.
+        scopes: ScopeTree. 函数和类的作用域.
+        programs: list. 长度为 max_lino + 1. 第 lino 行的行程序, 没有节点的行为空元组.
+            see compile_line()
+    """
+    __slots__ = ('kinds', 'vals', 'offsets', 'indents', 'linos', 'scopes',
+                 'programs')
+    
+    def __init__(self, lines: dict, indents: dict, scopes):
+        """
+        ARGS:
+            lines: {lino: [(kind, val), ...]}. lino 无需有序.
+            indents: {lino: indent}. 与 lines 有相同的键.
+            scopes: ScopeTree.
+        """
+        linos = sorted(lines.keys())
+        max_lino = linos[-1] if linos else 0
+        
+        self.kinds = array('B')
+        self.vals = []
+        self.offsets = array('I', [0]) * (max_lino + 2)
+        self.indents = array('h', [-1]) * (max_lino + 1)
+        self.linos = array('I', linos)
+        self.scopes = scopes
+        self.programs = [()] * (max_lino + 1)
+        
+        cursor = 0
+        last_lino = 0
+        for lino in linos:
+            for x in range(last_lino + 1, lino + 1):
+                self.offsets[x] = cursor
+            for kind, val in lines[lino]:
+                self.kinds.append(kind)
+                self.vals.append(val)
+            cursor += len(lines[lino])
+            self.indents[lino] = indents[lino]
+            self.programs[lino] = compile_line(lines[lino])
+            last_lino = lino
+        self.offsets[max_lino + 1] = cursor
+    
+    @property
+    def max_lino(self):
+        return self.linos[-1] if self.linos else 0
+    
+    def has_line(self, lino):
+        return 0 < lino < len(self.indents) and self.indents[lino] != -1
+    
+    def get_line(self, lino):
+        """
+        OT: ast_line: [(kind, val), ...]
+        """
+        start, end = self.offsets[lino], self.offsets[lino + 1]
+        return list(zip(self.kinds[start:end], self.vals[start:end]))
+    
+    def get_head(self, lino):
+        """
+        获取该行的第一个节点, 它能告诉我们该行是否为函数或类的定义.
+        
+        OT: (kind, val)
+        """
+        start = self.offsets[lino]
+        # assert the line is not empty.
+        assert start < self.offsets[lino + 1]
+        return self.kinds[start], self.vals[start]
+    
+    def get_program(self, lino):
+        """
+        OT: program. see compile_line()
+        """
+        return self.programs[lino]
+    
+    def get_indent(self, lino):
+        if 0 < lino < len(self.indents):
+            return self.indents[lino]
+        return -1
+    
+    def to_dicts(self):
+        """
+        转换为便于阅读的字典形式, 仅用于调试输出.
+        
+        OT: ({lino: [(kind_name, val), ...]}, {lino: indent})
+        """
+        tree = {
+            lino: [(KIND_NAMES[k], v) for k, v in self.get_line(lino)]
+            for lino in self.linos
+        }
+        indents = {lino: self.indents[lino] for lino in self.linos}
+        return tree, indents
+
+
+class ScopeTree:
+    """
+    函数和类的作用域区间树.
+    
+    每个作用域对应一个行号闭区间 [start, end], 子作用域的区间嵌套在父作用域的区间之内. 把
+    这些区间展开后, 整个文件被切分为首尾相接, 互不重叠的片段 (segment), 每个片段只属于一个
+    作用域 (包含它的最内层作用域). 因此查询某一行属于哪个作用域, 只需在片段的起始行上二分查
+    找.
+    
+    data format:
+        names: list. 作用域的名字. e.g. ['main', 'child_method', 'Init', ...]
+        kinds: array('B'). FUNCTION_DEF 或 CLASS_DEF.
+        parents: array('i'). 父作用域的下标, -1 表示模块层 (即 runtime_module).
+        starts: array('I'). 定义所在的行号. 作用域按 start 升序排列, 因此父作用域总是排
+            在子作用域之前.
+        ends: array('I'). 作用域的最后一行.
+        seg_starts: array('I'). 各片段的起始行号, 升序. 第一个片段从第 1 行开始, 最后一个
+            片段一直延伸到文件末尾.
+        seg_owners: array('i'). 各片段所属的作用域下标, -1 表示模块层.
+    """
+    __slots__ = ('names', 'kinds', 'parents', 'starts', 'ends', 'seg_starts',
+                 'seg_owners')
+    
+    def __init__(self, scopes: list):
+        """
+        ARGS:
+            scopes: [(start, end, kind, name, parent), ...]. 顺序任意, parent 为
+                父作用域在 scopes 中的下标, -1 表示模块层.
+        """
+        order = sorted(range(len(scopes)), key=lambda i: scopes[i][0])
+        index = {old: new for new, old in enumerate(order)}
+        index[-1] = -1
+        
+        self.names = [scopes[i][3] for i in order]
+        self.kinds = array('B', (scopes[i][2] for i in order))
+        self.parents = array('i', (index[scopes[i][4]] for i in order))
+        self.starts = array('I', (scopes[i][0] for i in order))
+        self.ends = array('I', (scopes[i][1] for i in order))
+        
+        self.seg_starts = array('I', [1])
+        self.seg_owners = array('i', [-1])
+        
+        stack = []  # 当前所在的作用域链
+        for i, start in enumerate(self.starts):
+            while stack and self.ends[stack[-1]] < start:
+                self.add_segment(self.ends[stack.pop()] + 1,
+                                 stack[-1] if stack else -1)
+            self.add_segment(start, i)
+            stack.append(i)
+        while stack:
+            self.add_segment(self.ends[stack.pop()] + 1,
+                             stack[-1] if stack else -1)
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def get_modules(self, top_module):
+        """
+        计算各作用域的 module 名. AClass.__init__ 被认作 AClass.
+        
+        IN: top_module: str. e.g. 'src.app'
+        OT: [module, ...]. 与 self.names 一一对应. e.g. ['src.app.main', 'src.app
+                .main.child_method', 'src.app.Init', 'src.app.Init', ...]
+        """
+        modules = []
+        # 父作用域总是排在子作用域之前, 因此可以顺序计算.
+        for name, parent in zip(self.names, self.parents):
+            parent_module = modules[parent] if parent != -1 else top_module
+            if name == '__init__':
+                modules.append(parent_module)
+            else:
+                modules.append(parent_module + '.' + name)
+        return modules
+    
+    def add_segment(self, start, owner):
+        if self.seg_starts[-1] == start:
+            # 前一个片段为空, 直接覆盖.
+            self.seg_owners[-1] = owner
+        else:
+            self.seg_starts.append(start)
+            self.seg_owners.append(owner)
+    
+    def get_owner(self, lino):
+        """
+        OT: int. 第 lino 行所属的作用域下标, -1 表示模块层.
+        """
+        return self.seg_owners[bisect_right(self.seg_starts, lino) - 1]
+    
+    def get_ranges(self, scope):
+        """
+        OT: [(start, stop), ...]. 属于该作用域 (不含子作用域) 的行号区间, 左闭右开. 最后
+                一个区间的 stop 可能为 None, 表示直到文件末尾.
+        """
+        return [x[:2] for x in self.iter_segments() if x[2] == scope]
+    
+    def iter_segments(self):
+        """
+        OT: iter[(start, stop, owner)]. stop 为 None 时表示直到文件末尾.
+        """
+        seg_starts = self.seg_starts
+        last = len(seg_starts) - 1
+        for i, owner in enumerate(self.seg_owners):
+            yield (seg_starts[i], seg_starts[i + 1] if i < last else None,
+                   owner)
 
 
+# ------------------------------------------------
+
 class AstAnalyser:
     root = None
     
@@ -12,86 +324,118 @@ class AstAnalyser:
         with open(file, mode='r', encoding='utf-8-sig') as f:
             text = f.read()
         self.root = ast_parse(text)
+        self.code_lines = text.split('\n')
+        # 注意不要用 text.splitlines(), 它还会在 '\x0c' 等字符处断行, 导致行号与 ast
+        # 节点的 lineno 对不上. 文本模式读取时 '\r\n' 已被统一转换为 '\n'.
+        
+        self.ast_table = None
     
-    def get_lino_indent_dict(self):
+    def parse(self):
         """
-        refer: {lkdemo}/ast_demo.py
+        一次遍历同时得到各行的节点, 各行的缩进和作用域树.
         
-        NOTICE: 使用 regex 计算行缩进, 不要用 node.col_offset.
+        NOTICE: 行缩进取自已读入的 self.code_lines, 不要用 node.col_offset.
             为什么: 假设存在以下代码:
                 1 | def func():
                 2 |     if a == 1:
                 3 |         pass
-            对第 2 行 `if a == 1:`, 使用正则计算结果是 indent = 4, 而 node.col_offset
+            对第 2 行 `if a == 1:`, 计算行首空格得到 indent = 4, 而 node.col_offset
             的值是 7. 原因在于, node.col_offset 计算的是变量 `a` 的列位置, 而非该行的缩进
             位置.
         
-        IN: self.file
-            self.root
-        OT: {lino: indent}
-                lino: int. count from 1 but not consecutive. the linos are
-                    already sorted by ascending order.
+        IN: self.root
+            self.code_lines
+        OT: AstTable
+                lino: int. count from 1 but not consecutive.
+                kind: int. see NODE_KINDS.
+                val: str/dict. e.g. 'os.path.abspath', {'os': 'os'}, ...
                 indent: int. the column offset, assert all of them would be
                     integral multiple of 4, e.g. 0, 4, 8, 12, ...
+                scopes: ScopeTree.
         """
-        from lk_utils.read_and_write_basic import read_file_by_line
-        lino_indent = {}
+        if self.ast_table is not None:
+            return self.ast_table
         
-        code_lines = read_file_by_line(self.file)
-        reg = re.compile(r'^ *')
+        lines = {}
+        indents = {}
+        scopes = []  # format: [[start, end, kind, name, parent], ...]
+        code_lines = self.code_lines
+        node_kinds = NODE_KINDS
         
-        for node in ast_walk(self.root):
-            if not (hasattr(node, 'lineno') and hasattr(node, 'col_offset')):
-                continue
-            if node.lineno in lino_indent:
+        # 与 ast.walk() 相同的广度优先顺序, 同时记录每个节点所属的作用域, 以便得到作用域的
+        # 行号区间.
+        todo = deque([(self.root, -1)])
+        while todo:
+            node, owner = todo.popleft()
+            kind = node_kinds.get(type(node), OTHER)
+            
+            if kind == FUNCTION_DEF or kind == CLASS_DEF:
+                # python 3.8 以下没有 end_lineno, 此时 end 由下面的子孙节点逐步撑开.
+                scopes.append([
+                    node.lineno, getattr(node, 'end_lineno', None)
+                    or node.lineno, kind, node.name, owner
+                ])
+                todo.extend((x, len(scopes) - 1)
+                            for x in iter_child_nodes(node))
+            else:
+                todo.extend((x, owner) for x in iter_child_nodes(node))
+            
+            if not hasattr(node, 'lineno'):
                 continue
+            lino = node.lineno
+            if owner != -1 and scopes[owner][1] < lino:
+                scopes[owner][1] = lino
             if node.col_offset == -1:
                 # 说明这个节点是 docstring
                 continue
-            lino_indent[node.lineno] = len(
-                reg.findall(
-                    code_lines[node.lineno - 1]
-                )[0]
-            )
+            x = lines.get(lino)
+            if x is None:
+                x = lines[lino] = []
+                line = code_lines[lino - 1]
+                indents[lino] = len(line) - len(line.lstrip(' '))
+            x.append((kind, self.intern_val(self.eval_node(node))))
         
-        # sort linos
-        sorted_lino_indent = {
-            k: lino_indent[k]
-            for k in sorted(lino_indent.keys())
-        }
+        # 子作用域总是在父作用域之后被发现, 因此倒序一遍即可把 end 传递给所有祖先.
+        for start, end, _, _, parent in reversed(scopes):
+            if parent != -1 and scopes[parent][1] < end:
+                scopes[parent][1] = end
         
-        return sorted_lino_indent
+        self.ast_table = AstTable(lines, indents, ScopeTree(scopes))
+        return self.ast_table
     
-    def main(self):
+    def get_lino_indent_dict(self):
         """
-        IN: self.root
-        OT: dict. {
-                lino: [(node_type, node_value), (...), ...], ...
-            }
+        refer: {lkdemo}/ast_demo.py
+        
+        IN: self.parse()
+        OT: {lino: indent}
                 lino: int. count from 1 but not consecutive. the linos are
                     already sorted by ascending order.
-                node_type: str. refer to _ast class types, e.g. "<class '_ast
-                    .Import'>", "<class '_ast.FunctionDef'>", ...
-                node_value: str/dict. e.g. 'os.path.abspath', {'os': 'os'}, ...
+                indent: int. e.g. 0, 4, 8, 12, ...
         """
-        out = {}
-        
-        for node in ast_walk(self.root):
-            if not hasattr(node, 'lineno'):
-                continue
-            if node.col_offset == -1:
-                # 说明这个节点是 docstring
-                continue
-            x = out.setdefault(node.lineno, [])
-            x.append((str(type(node)), self.eval_node(node)))
-        
-        # sort linos
-        sorted_out = {
-            k: out[k]
-            for k in sorted(out.keys())
-        }
-        
-        return sorted_out
+        return self.parse().to_dicts()[1]
+    
+    def main(self):
+        """
+        IN: self.parse()
+        OT: AstTable. see self.parse()
+        """
+        return self.parse()
+    
+    @staticmethod
+    def intern_val(val):
+        """
+        大项目中大量重复出现 'self', 'print', 'lk.loga' 等相同的值, intern 后只保存一份.
+        """
+        if isinstance(val, str):
+            return intern(val)
+        elif isinstance(val, dict):
+            return {
+                intern(k) if isinstance(k, str) else k:
+                    intern(v) if isinstance(v, str) else v
+                for k, v in val.items()
+            }
+        return val
     
     def eval_node(self, node):
         result = None
@@ -199,7 +543,7 @@ def dump_asthelper_result():
     """
     from lk_utils.read_and_write_basic import write_json
     helper = AstAnalyser('../temp/in.py')
-    res = helper.main()
+    res = helper.main().to_dicts()[0]
     write_json(res, '../temp/out.json')
 
 
@@ -227,7 +571,7 @@ def dump_by_filter_schema(file, schema=1):
             dump collector to './ast_helper_result.json'
     """
     helper = AstAnalyser(file)
-    res = helper.main()
+    res = helper.main()  # type: AstTable
     
     lib_dict = {}
     var_dict = {}
@@ -235,18 +579,18 @@ def dump_by_filter_schema(file, schema=1):
     cls_dict = {}
     
     dict_filter = {
-        "<class '_ast.Import'>"     : lib_dict,
-        "<class '_ast.ImportFrom'>" : lib_dict,
-        "<class '_ast.Assign'>"     : var_dict,
-        "<class '_ast.FunctionDef'>": fun_dict,
-        "<class '_ast.ClassDef'>"   : cls_dict,
+        IMPORT      : lib_dict,
+        IMPORT_FROM : lib_dict,
+        ASSIGN      : var_dict,
+        FUNCTION_DEF: fun_dict,
+        CLASS_DEF   : cls_dict,
     }
     
-    for lino, data in res.items():
-        for i in data:
-            type_, value = i
-            if type_ in dict_filter:
-                d = dict_filter.get(type_)
+    for lino in res.linos:
+        for i in res.get_line(lino):
+            kind, value = i
+            if kind in dict_filter:
+                d = dict_filter.get(kind)
                 if isinstance(value, str):
                     # schema 1: use list to store vars
                     node = d.setdefault(value, [])
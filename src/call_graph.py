@@ -0,0 +1,371 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from src.symbol_table import SymbolTable
+
+# ------------------------------------------------ binary format
+
+"""
+调用图的二进制格式 (小端序, 所有区段都按 4 字节对齐, 便于 mmap 后直接 cast):
+    header: <4sIIIII> magic, version, n_nodes, n_edges, n_rows, seg_size
+    offsets: uint32 * (n_nodes + 1). 第 i 个节点的被调用者位于 targets[offsets[i]:
+        offsets[i + 1]].
+    targets: int32 * n_edges.
+    rev_offsets: uint32 * (n_nodes + 1). 反向索引, 第 i 个节点的调用者位于 sources[
+        rev_offsets[i]:rev_offsets[i + 1]].
+    sources: int32 * n_edges.
+    rows: int32 * n_rows. 被记录过的调用者, 按记录的顺序.
+    in_degrees: uint32 * n_nodes.
+    parents: int32 * n_nodes. 符号表的前缀树, see src.symbol_table.SymbolTable.
+    seg_offsets: uint32 * (n_nodes + 1). 第 i 个节点的片段 (utf-8) 位于 seg_data[
+        seg_offsets[i]:seg_offsets[i + 1]].
+    seg_data: bytes * seg_size, 末尾补齐到 4 字节.
+节点即符号表中的 id, 0 号节点是符号表的根节点 (空名字).
+"""
+MAGIC = b'PCCG'
+VERSION = 2
+HEADER = struct.Struct('<4sIIIII')
+
+
+class CallGraph:
+    """
+    以压缩稀疏行 (CSR) 的形式保存的调用图, 由 src.writer.Writer#record() 逐步构建.
+    
+    每次 record 把一个调用者的全部被调用者作为一个行块 (block) 追加到 targets 的末尾, 并通
+    过 self.row_of 从节点 id 找到它的行块. 同一个调用者被再次记录时, 旧的行块作废, 在
+    dump() 时被清除.
+    
+    record 的同时维护反向索引 self.sources, 因此 "谁调用了 X" 只需要查看 X 自己的调用者,
+    不需要遍历所有的行块.
+    
+    data format:
+        self.rows: array('i'). 各行块的调用者 id, 按记录的顺序.
+        self.starts: array('I'). 长度为行块数 + 1. 第 b 个行块的被调用者位于 targets[
+            starts[b]:starts[b + 1]].
+        self.targets: array('i'). 被调用者的 id.
+        self.row_of: array('i'). 下标是节点 id, 值是该节点最新的行块, 未被记录过的节点为
+            -1.
+        self.in_degrees: array('I'). 下标是节点 id.
+        self.sources: [array('i'), ...]. 下标是节点 id, 值是它的调用者, 每条边对应一
+            个元素 (同一个调用者多次调用它时会重复出现).
+    """
+    
+    def __init__(self, symbols=None):
+        """
+        ARGS:
+            symbols: None/SymbolTable. 为 None 时新建一个.
+        """
+        self.symbols = SymbolTable() if symbols is None else symbols
+        self.rows = array('i')
+        self.starts = array('I', [0])
+        self.targets = array('i')
+        self.row_of = array('i')
+        self.in_degrees = array('I')
+        self.sources = []
+        self.stale = 0  # 已作废的行块数
+    
+    def __contains__(self, id_):
+        return 0 <= id_ < len(self.row_of) and self.row_of[id_] != -1
+    
+    def __len__(self):
+        """
+        OT: int. 被记录过的调用者的数量.
+        """
+        return len(self.rows) - self.stale
+    
+    def node_count(self):
+        """
+        OT: int. 节点 id 的上界 (不含). 所有出现过的调用者和被调用者的 id 都小于它.
+        """
+        return len(self.row_of)
+    
+    def grow(self, size):
+        n = size - len(self.row_of)
+        if n > 0:
+            self.row_of.extend(array('i', [-1]) * n)
+            self.in_degrees.extend(array('I', [0]) * n)
+            self.sources.extend(array('i') for _ in range(n))
+    
+    # ------------------------------------------------ updates
+    
+    def record(self, caller: int, callees):
+        """
+        ARGS:
+            caller: int. 调用者的 id.
+            callees: iterable. [id, ...]. 被调用者的 id.
+        """
+        callees = array('i', callees)
+        self.grow(max(caller, max(callees, default=0)) + 1)
+        
+        old = self.row_of[caller]
+        if old != -1:
+            for x in self.targets[self.starts[old]:self.starts[old + 1]]:
+                self.in_degrees[x] -= 1
+                self.sources[x].remove(caller)
+            self.stale += 1
+        
+        self.row_of[caller] = len(self.rows)
+        self.rows.append(caller)
+        self.targets.extend(callees)
+        self.starts.append(len(self.targets))
+        for x in callees:
+            self.in_degrees[x] += 1
+            self.sources[x].append(caller)
+    
+    # ------------------------------------------------ queries
+    
+    def get_callees(self, id_):
+        """
+        OT: array('i'). 被调用者的 id. 未被记录过的节点返回空数组.
+        """
+        if id_ in self:
+            b = self.row_of[id_]
+            return self.targets[self.starts[b]:self.starts[b + 1]]
+        return array('i')
+    
+    def out_degree(self, id_):
+        if id_ in self:
+            b = self.row_of[id_]
+            return self.starts[b + 1] - self.starts[b]
+        return 0
+    
+    def in_degree(self, id_):
+        if 0 <= id_ < len(self.in_degrees):
+            return self.in_degrees[id_]
+        return 0
+    
+    def get_callers(self, id_):
+        """
+        OT: array('i'). 直接调用 id_ 的节点, 每条边对应一个元素.
+        """
+        if 0 <= id_ < len(self.sources):
+            return self.sources[id_]
+        return array('i')
+    
+    def callers(self):
+        """
+        OT: iter[id]. 被记录过的调用者, 按 (最后一次) 记录的顺序.
+        """
+        row_of = self.row_of
+        for b, caller in enumerate(self.rows):
+            if row_of[caller] == b:
+                yield caller
+    
+    # ------------------------------------------------ serialization
+    
+    def to_csr(self):
+        """
+        转换为以节点 id 为行下标的标准 CSR, 同时清除作废的行块.
+        
+        OT: (offsets, targets)
+                offsets: array('I'). 长度为节点数 + 1.
+                targets: array('i').
+        """
+        n = len(self.symbols.segments)
+        self.grow(n)
+        
+        offsets = array('I', [0]) * (n + 1)
+        for id_ in range(n):
+            offsets[id_ + 1] = offsets[id_] + self.out_degree(id_)
+        targets = array('i')
+        for id_ in range(n):
+            if id_ in self:
+                targets.extend(self.get_callees(id_))
+        return offsets, targets
+    
+    def to_reverse_csr(self):
+        """
+        OT: (rev_offsets, sources). 反向索引的 CSR, 格式同 to_csr().
+        """
+        n = len(self.symbols.segments)
+        self.grow(n)
+        
+        rev_offsets = array('I', [0]) * (n + 1)
+        sources = array('i')
+        for id_ in range(n):
+            sources.extend(self.sources[id_])
+            rev_offsets[id_ + 1] = len(sources)
+        return rev_offsets, sources
+    
+    def dump(self, path):
+        """
+        保存为单个二进制文件, 可以通过 CsrGraph.load() 以 mmap 的方式读取.
+        """
+        offsets, targets = self.to_csr()
+        rev_offsets, sources = self.to_reverse_csr()
+        rows = array('i', self.callers())
+        n = len(offsets) - 1
+        
+        segs = [x.encode('utf-8') for x in self.symbols.segments]
+        seg_offsets = array('I', [0]) * (n + 1)
+        for i, x in enumerate(segs):
+            seg_offsets[i + 1] = seg_offsets[i] + len(x)
+        seg_data = b''.join(segs)
+        
+        sections = (offsets, targets, rev_offsets, sources, rows,
+                    self.in_degrees[:n], self.symbols.parents, seg_offsets)
+        if sys.byteorder != 'little':
+            sections = tuple(array(x.typecode, x) for x in sections)
+            for x in sections:
+                x.byteswap()
+        
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(HEADER.pack(
+                MAGIC, VERSION, n, len(targets), len(rows), len(seg_data)
+            ))
+            for x in sections:
+                f.write(x.tobytes())
+            f.write(seg_data)
+            f.write(b'\0' * (-len(seg_data) % 4))
+        os.replace(temp, path)
+
+
+class CsrGraph:
+    """
+    通过 mmap 读取的只读调用图, 查询接口与 CallGraph 相同. 各区段直接映射为 memoryview,
+    不需要解析或复制, 因此打开很大的调用图也是瞬间完成的.
+    
+    data format: see the binary format at the top of this module.
+    """
+    
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = buf = memoryview(self.mm)
+        
+        magic, version, n, n_edges, n_rows, seg_size = HEADER.unpack_from(buf)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(
+                'not a call graph file (v{})'.format(VERSION), path
+            )
+        
+        pos = HEADER.size
+        sections = []
+        for fmt, count in (('I', n + 1), ('i', n_edges), ('I', n + 1),
+                           ('i', n_edges), ('i', n_rows), ('I', n), ('i', n),
+                           ('I', n + 1)):
+            x = buf[pos:pos + count * 4].cast(fmt)
+            if sys.byteorder != 'little':
+                x = array(fmt, x)
+                x.byteswap()
+            sections.append(x)
+            pos += count * 4
+        (self.offsets, self.targets, self.rev_offsets, self.sources, self.rows,
+         self.in_degrees, self.parents, self.seg_offsets) = sections
+        self.seg_data = buf[pos:pos + seg_size]
+        
+        self.recorded = None  # format: {id, ...}. 首次查询时建立.
+        self.names = None  # format: {name: id}. 首次调用 self.find() 时建立.
+    
+    @classmethod
+    def load(cls, path):
+        return cls(path)
+    
+    def close(self):
+        for k in ('offsets', 'targets', 'rev_offsets', 'sources', 'rows',
+                  'in_degrees', 'parents', 'seg_offsets', 'seg_data', 'buf'):
+            x = self.__dict__.pop(k, None)
+            if isinstance(x, memoryview):
+                x.release()
+        self.mm.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *_):
+        self.close()
+    
+    def __contains__(self, id_):
+        if self.recorded is None:
+            self.recorded = set(self.rows)
+        return id_ in self.recorded
+    
+    def __len__(self):
+        return len(self.rows)
+    
+    def node_count(self):
+        return len(self.in_degrees)
+    
+    def get_callees(self, id_):
+        """
+        OT: memoryview. 被调用者的 id. 不在图中的节点 (包括 self.find() 返回的 -1)
+                返回空的 memoryview.
+        """
+        if 0 <= id_ < len(self.in_degrees):
+            return self.targets[self.offsets[id_]:self.offsets[id_ + 1]]
+        return self.targets[:0]
+    
+    def out_degree(self, id_):
+        if 0 <= id_ < len(self.in_degrees):
+            return self.offsets[id_ + 1] - self.offsets[id_]
+        return 0
+    
+    def in_degree(self, id_):
+        if 0 <= id_ < len(self.in_degrees):
+            return self.in_degrees[id_]
+        return 0
+    
+    def get_callers(self, id_):
+        """
+        OT: memoryview. 直接调用 id_ 的节点.
+        """
+        if 0 <= id_ < len(self.in_degrees):
+            return self.sources[
+                self.rev_offsets[id_]:self.rev_offsets[id_ + 1]
+            ]
+        return self.sources[:0]
+    
+    def callers(self):
+        return iter(self.rows)
+    
+    def get_name(self, id_):
+        segs = []
+        while id_ > 0:
+            segs.append(bytes(self.seg_data[
+                self.seg_offsets[id_]:self.seg_offsets[id_ + 1]
+            ]).decode('utf-8'))
+            id_ = self.parents[id_]
+        return '.'.join(reversed(segs))
+    
+    def find(self, name):
+        """
+        OT: int. name 的 id, 不存在时返回 -1.
+        """
+        if self.names is None:
+            self.names = {
+                self.get_name(i): i for i in range(1, len(self.parents))
+            }
+        return self.names.get(name, -1)
+
+
+# ------------------------------------------------ traversal
+
+def iter_callers(graph, id_, max_depth=None):
+    """
+    按广度优先的顺序, 逐个产出直接或间接调用 id_ 的节点. 每个节点只产出一次 (以最短的
+    调用距离), 调用方可以随时停止迭代, 未被访问的部分不会被计算.
+    
+    ARGS:
+        graph: CallGraph/CsrGraph.
+        id_: int.
+        max_depth: None/int. 最大的调用距离, 1 表示只查询直接调用者. 为 None 时不限制.
+    OT: iter[(caller, depth)]. e.g. [(12, 1), (3, 1), (7, 2), ...]
+    """
+    seen = {id_}
+    layer = [id_]
+    depth = 0
+    while layer and (max_depth is None or depth < max_depth):
+        depth += 1
+        next_layer = []
+        for x in layer:
+            for caller in graph.get_callers(x):
+                if caller not in seen:
+                    seen.add(caller)
+                    next_layer.append(caller)
+                    yield caller, depth
+        layer = next_layer
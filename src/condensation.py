@@ -0,0 +1,168 @@
+from array import array
+
+
+class Condensation:
+    """
+    调用图的强连通分量 (SCC) 缩点. 互相调用 (包括自调用) 的 module 被合并为一个分量, 缩点后
+    的图是有向无环图 (DAG), 层叠视图和可达性查询都可以在它上面进行, 不需要再逐条路径地检查
+    回调.
+    
+    分量由 Tarjan 算法 (以显式栈代替递归) 求得, 并按求得的顺序编号, 这个顺序是逆拓扑序: 若
+    分量 a 调用分量 b, 则 a > b. 因此按编号从小到大处理分量时, 被调用者总是先于调用者.
+    
+    data format:
+        self.comp_of: array('i'). 下标是节点 id, 值是它所属的分量.
+        self.member_offsets: array('I'). 长度为分量数 + 1.
+        self.members: array('i'). 第 c 个分量的成员 (节点 id, 从小到大) 位于 members[
+            member_offsets[c]:member_offsets[c + 1]].
+        self.offsets: array('I'). 长度为分量数 + 1.
+        self.targets: array('i'). 第 c 个分量调用的其他分量 (已去重, 按首次出现的顺序)
+            位于 targets[offsets[c]:offsets[c + 1]].
+        self.cyclic: bytearray. 下标是分量, 成员多于一个或存在自调用时为 1.
+    """
+    
+    def __init__(self, graph):
+        """
+        ARGS:
+            graph: src.call_graph.CallGraph/CsrGraph.
+        """
+        self.graph = graph
+        n = graph.node_count()
+        self.comp_of = self.find_components(graph, n)
+        count = max(self.comp_of, default=-1) + 1
+        
+        # 按分量对节点做计数排序.
+        sizes = array('I', [0]) * (count + 1)
+        for c in self.comp_of:
+            sizes[c + 1] += 1
+        for c in range(count):
+            sizes[c + 1] += sizes[c]
+        self.member_offsets = array('I', sizes)
+        self.members = array('i', [0]) * n
+        for id_, c in enumerate(self.comp_of):
+            self.members[sizes[c]] = id_
+            sizes[c] += 1
+        
+        # 缩点后的边.
+        self.offsets = array('I', [0])
+        self.targets = array('i')
+        self.cyclic = bytearray(count)
+        last = array('i', [-1]) * count  # 防止同一分量的边被重复加入
+        for c in range(count):
+            members = self.get_members(c)
+            if len(members) > 1:
+                self.cyclic[c] = 1
+            for id_ in members:
+                for x in graph.get_callees(id_):
+                    cx = self.comp_of[x]
+                    if cx == c:
+                        self.cyclic[c] = 1
+                    elif last[cx] != c:
+                        last[cx] = c
+                        self.targets.append(cx)
+            self.offsets.append(len(self.targets))
+    
+    @staticmethod
+    def find_components(graph, n):
+        """
+        Tarjan 算法.
+        
+        OT: array('i'). 下标是节点 id, 值是它所属的分量.
+        """
+        index = array('i', [-1]) * n  # 节点被访问的次序
+        low = array('i', [0]) * n
+        on_stack = bytearray(n)
+        comp_of = array('i', [-1]) * n
+        stack = []
+        counter = 0
+        count = 0
+        
+        for root in range(n):
+            if index[root] != -1:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            
+            # frame: [node, callees, next_index]
+            frames = [[root, graph.get_callees(root), 0]]
+            while frames:
+                frame = frames[-1]
+                v, calls, i = frame
+                if i < len(calls):
+                    frame[2] = i + 1
+                    w = calls[i]
+                    if index[w] == -1:
+                        index[w] = low[w] = counter
+                        counter += 1
+                        stack.append(w)
+                        on_stack[w] = 1
+                        frames.append([w, graph.get_callees(w), 0])
+                    elif on_stack[w] and index[w] < low[v]:
+                        low[v] = index[w]
+                    continue
+                
+                frames.pop()
+                if frames:
+                    u = frames[-1][0]
+                    if low[v] < low[u]:
+                        low[u] = low[v]
+                if low[v] == index[v]:
+                    # v 是分量的根, 栈中 v 以上的节点都属于这个分量.
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        comp_of[w] = count
+                        if w == v:
+                            break
+                    count += 1
+        
+        return comp_of
+    
+    def __len__(self):
+        """
+        OT: int. 分量的数量.
+        """
+        return len(self.offsets) - 1
+    
+    def get_component(self, id_):
+        """
+        OT: int. 节点所属的分量, 不在图中的节点返回 -1.
+        """
+        if 0 <= id_ < len(self.comp_of):
+            return self.comp_of[id_]
+        return -1
+    
+    def get_members(self, comp):
+        """
+        OT: array('i'). 分量的成员 (节点 id), 从小到大.
+        """
+        return self.members[
+            self.member_offsets[comp]:self.member_offsets[comp + 1]
+        ]
+    
+    def get_callees(self, comp):
+        """
+        OT: array('i'). 分量调用的其他分量.
+        """
+        if 0 <= comp < len(self):
+            return self.targets[self.offsets[comp]:self.offsets[comp + 1]]
+        return array('i')
+    
+    def out_degree(self, comp):
+        if 0 <= comp < len(self):
+            return self.offsets[comp + 1] - self.offsets[comp]
+        return 0
+    
+    def is_cyclic(self, comp):
+        return bool(self.cyclic[comp])
+    
+    def cycles(self):
+        """
+        OT: iter[array('i')]. 每个成环的分量 (互相调用的 module 群, 或自调用的 module)
+                的成员, 每个分量只出现一次.
+        """
+        for c in range(len(self)):
+            if self.cyclic[c]:
+                yield self.get_members(c)
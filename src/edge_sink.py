@@ -0,0 +1,60 @@
+import json
+
+
+class EdgeSink:
+    """
+    以 NDJSON (每行一个 json 对象) 的形式, 在分析的过程中实时输出调用关系. 下游工具不需要
+    等到分析结束就可以开始读取部分的调用图; 即使分析中途崩溃, 已经输出的部分也是完整可用的.
+    
+    每次 record() 之后立即 flush, 因此文件中的每一行都是完整的. 只有正常结束时才会写入最后
+    的 'done' 事件, 下游可以据此判断输出是否完整.
+    
+    事件:
+        {"event": "module", "caller": "src.app.main", "edges": 2}
+            caller 分析完毕, 紧随其后的 edges 行是它的边. 没有被调用者的 caller 也会输出
+            这个事件 (edges 为 0), 因此下游可以区分 "不调用任何 module" 和 "尚未分析".
+            同一个 caller 再次出现时, 它的边被重置为之后的 edges 行. 如果文件末尾的边少
+            于 edges, 说明分析在写入这些边时中断.
+        {"event": "edge", "caller": "src.app.main", "callee": "src.app.Init"}
+            caller 的调用链中的每一项对应一行, 顺序与调用链相同.
+        {"event": "file", "pyfile": "D:/myprj/src/app.py", "modules": 12,
+         "edges": 80}
+            一个 pyfile 分析完毕. modules 和 edges 是该 pyfile 输出的调用者和边的数量.
+            (src.app.ScopeRunner 逐个 module 地分析, 不输出这个事件.)
+        {"event": "done", "files": 3, "modules": 40, "edges": 260}
+            分析正常结束.
+    """
+    
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.modules = 0  # 上一个 'file' 事件之后的调用者数量
+        self.edges = 0
+        self.total = {'files': 0, 'modules': 0, 'edges': 0}
+    
+    def emit(self, event: dict):
+        self.file.write(json.dumps(event, ensure_ascii=False) + '\n')
+    
+    def record(self, caller: str, call_chain):
+        self.emit({'event': 'module', 'caller': caller,
+                   'edges': len(call_chain)})
+        for callee in call_chain:
+            self.emit({'event': 'edge', 'caller': caller, 'callee': callee})
+        self.file.flush()
+        self.modules += 1
+        self.edges += len(call_chain)
+    
+    def finish_file(self, pyfile):
+        self.emit({'event': 'file', 'pyfile': pyfile, 'modules': self.modules,
+                   'edges': self.edges})
+        self.file.flush()
+        self.total['files'] += 1
+        self.total['modules'] += self.modules
+        self.total['edges'] += self.edges
+        self.modules = self.edges = 0
+    
+    def close(self):
+        self.total['modules'] += self.modules
+        self.total['edges'] += self.edges
+        self.modules = self.edges = 0
+        self.emit(dict(event='done', **self.total))
+        self.file.close()
@@ -0,0 +1,94 @@
+import gzip
+import json
+
+
+class JsonStream:
+    """
+    以流的方式写入嵌套的 json 对象: 逐个写入键值, 不需要先在内存中构建整个对象. 输出与
+    `json.dumps(obj, ensure_ascii=False)` 完全相同.
+    
+    usage:
+        with JsonStream('out.json') as out:
+            out.begin()  # {
+            out.begin('a')  # "a": {
+            out.item('b', [1, 2])  # "b": [1, 2]
+            out.end()  # }
+            out.end()  # }
+        -> {"a": {"b": [1, 2]}}
+    
+    写入的内容先暂存在 self.chunks 中, 累计达到 chunk_size 个字符后再一次性写入文件.
+    
+    data format:
+        self.firsts: [bool, ...]. 每一层打开的对象是否还没有写入任何键值, 用于决定是否
+            需要写入分隔符 ', '.
+        self.keys: {key: encoded_key}. 键的编码缓存. 层叠视图中同一个 module 名会出现
+            很多次.
+    """
+    
+    def __init__(self, path, chunk_size=1 << 16):
+        """
+        ARGS:
+            path: str. 以 '.gz' 结尾时以 gzip 压缩.
+            chunk_size: int.
+        """
+        if path.endswith('.gz'):
+            self.file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self.file = open(path, 'w', encoding='utf-8')
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.size = 0
+        self.firsts = []
+        self.keys = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *_):
+        self.close()
+    
+    def write(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+    
+    def flush(self):
+        self.file.write(''.join(self.chunks))
+        self.chunks.clear()
+        self.size = 0
+    
+    def close(self):
+        self.flush()
+        self.file.close()
+    
+    def key(self, key):
+        if self.firsts[-1]:
+            self.firsts[-1] = False
+        else:
+            self.write(', ')
+        encoded = self.keys.get(key)
+        if encoded is None:
+            encoded = self.keys[key] = json.dumps(key, ensure_ascii=False)
+        self.write(encoded)
+        self.write(': ')
+    
+    def begin(self, key=None):
+        """
+        打开一个对象. 最外层的对象没有键, 其余的对象作为当前对象的 key 的值.
+        """
+        if self.firsts:
+            self.key(key)
+        self.write('{')
+        self.firsts.append(True)
+    
+    def end(self):
+        self.write('}')
+        self.firsts.pop()
+    
+    def item(self, key, value):
+        """
+        写入一个键值, value 可以是任何能被 json.dumps 序列化的对象.
+        """
+        self.key(key)
+        self.write(json.dumps(value, ensure_ascii=False))
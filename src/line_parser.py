@@ -1,51 +1,154 @@
-from lk_utils.lk_logger import lk
+from collections import OrderedDict
+from itertools import count
+
+from src.ast_analyser import OP_ARG, OP_ASSIGN, OP_DEFINE, OP_IMPORT, \
+    OP_RESOLVE, compile_line
 
 
 class VarsHolder:
+    """
+    链式作用域, 查找顺序为: local -> enclosing -> class -> global -> builtins.
+    
+    除 local 以外的各层 (frame) 都由调用者共享传入, 本类只读不写 (copy-on-write: 写入
+    总是落在私有的 local 中), 因此切换作用域 (reset) 时不需要复制任何 dict.
+    
+    data format:
+        self.vars: {var: module}. local, 唯一可写的一层. 只记录与外层解析结果不同的变
+            量.
+        self.frames: [frame, ...]. 共享的 enclosing 和 class 层, 由外到内排列.
+            frame: {var: module}
+        self.global_vars: {var: module}. 通常是 src.assign_analyser.AssignAnalyser
+            .top_assigns.
+        self.cache: {var: module}. 在 frames 和 global_vars 中查找的结果. 这几层在
+            reset 之前不会改变, 因此同一个作用域内反复出现的变量 (如 'self', 'os')
+            只需查找一次.
+        self.version: int. 绑定状态的版本号. 任何绑定的变化都会得到新的版本号; 而
+            reset() 到相同的 frames 时 (local 为空), 会得到与上次相同的版本号. 因此
+            版本号相同意味着所有变量的解析结果都相同. see LineMemo
+        self.versions: {chain: (version, frames)}. chain 为各 frame 的 id 组成的元
+            组. 同时保存 frames 本身, 以免 frame 被回收后 id 被复用.
+    builtins 层 (如 'print', 'len') 不被追踪, 与未知的变量一样解析为 None.
+    """
     
     def __init__(self, global_vars=None):
         if global_vars:
             self.global_vars = global_vars
         else:
             self.global_vars = {}
+        self.frames = []
         self.vars = {}  # format: {var: module}
-    
-    def update_global(self, var, module):
-        self.global_vars.update({var: module})
+        self.cache = {}
+        
+        self.counter = count(1)
+        self.version = 0
+        self.versions = {}
     
     def update(self, var, module):
+        if self.get(var) == module:
+            # 例如方法的参数 'self', 它的值已由 class 层提供.
+            return
         self.vars.update({var: module})
+        self.version = next(self.counter)
     
     def get(self, var):
         if var in self.vars:
-            return self.vars.get(var)
+            return self.vars[var]
+        try:
+            return self.cache[var]
+        except KeyError:
+            pass
+        
+        module = None
+        for frame in reversed(self.frames):
+            if var in frame:
+                module = frame[var]
+                break
         else:
-            return self.global_vars.get(var)
+            if var in self.global_vars:
+                module = self.global_vars[var]
+            # else: builtins 或未知的变量.
+        self.cache[var] = module
+        return module
+    
+    def reset(self, frames=()):
+        """
+        ARGS:
+            frames: iterable. [frame, ...]. 由外到内排列, 只读. 空的 frame 会被略过.
+        """
+        frames = tuple(x for x in frames if x)
+        chain = tuple(map(id, frames))
+        x = self.versions.get(chain)
+        if x is None:
+            x = self.versions[chain] = (next(self.counter), frames)
+        self.version = x[0]
+        
+        self.frames = list(frames)
+        self.vars = {}
+        self.cache.clear()
+
+
+class LineMemo:
+    """
+    行解析结果的 LRU 缓存. 项目中大量的行有着相同的形状, 例如 `lk.logt(...)`, `self.x
+    .y()`, `print(...)` 等, 它们编译得到的行程序相同 (see src.ast_analyser
+    .compile_line()). 在绑定状态相同 (VarsHolder#version 相同) 时, 它们的解析结果也相
+    同, 因此可以直接复用.
+    
+    只有执行前后版本号不变 (即没有改变任何绑定) 的行才会被缓存, 因为命中缓存时不会重新执行
+    该行. 绑定变化后版本号随之改变, 旧的条目不会再被命中, 最终被 LRU 淘汰.
+    
+    data format:
+        self.data: OrderedDict. {(version, program): (module, ...)}
+    """
+    
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
     
-    def reset(self, vars_: dict):
-        self.vars = vars_
+    def get(self, key):
+        try:
+            value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
     
-    def clear(self):
-        self.vars.clear()
+    def put(self, key, value):
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+    
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits'     : self.hits,
+            'misses'   : self.misses,
+            'evictions': self.evictions,
+            'entries'  : len(self.data),
+            'hit_rate' : round(self.hits / total, 4) if total else 0.0,
+        }
 
 
 class LineParser:
     
-    def __init__(self, top_module, global_vars=None):
+    def __init__(self, top_module, global_vars=None, memo=None):
+        """
+        ARGS:
+            top_module: str. e.g. 'src.app'
+            global_vars: None/dict. {var: module}
+            memo: None/LineMemo. 为 None 时不缓存行的解析结果.
+        """
         self.top_module = top_module
         self.vars_holder = VarsHolder(global_vars)
-        
-        self.support_methods = {
-            "<class '_ast.arg'>"        : self.parse_arg,
-            "<class '_ast.Assign'>"     : self.parse_assign,
-            "<class '_ast.Attribute'>"  : self.parse_attribute,
-            "<class '_ast.Call'>"       : self.parse_call,
-            "<class '_ast.ClassDef'>"   : self.parse_class_def,
-            "<class '_ast.FunctionDef'>": self.parse_function_def,
-            "<class '_ast.Import'>"     : self.parse_import,
-            "<class '_ast.ImportFrom'>" : self.parse_import,
-            # "<class '_ast.Name'>"       : self.parse_name,
-        }
+        self.memo = memo
+        self.self_frames = {}  # format: {master_module: {'self': module}}
     
     def get_vars(self):
         return self.vars_holder.vars
@@ -55,182 +158,114 @@ class LineParser:
     
     def reset(self, var_reachables, master_module):
         """
-        caller: src.module_analyser.ModuleAnalyser#analyse_module
+        ARGS:
+            var_reachables: tuple. (frame, ...). 外层作用域的符号表, 由外到内排列,
+                只读. see src.assign_analyser.AssignAnalyser
+                #indexing_assign_reachables()
+            master_module: str. 'self' 所指向的 module, 为空时不设置.
+        
+        caller: src.module_analyser.ModuleAnalyser#analyse_scope
         """
-        if var_reachables:
-            self.vars_holder.reset(var_reachables)
-        else:
-            self.vars_holder.clear()
         if master_module:
-            self.vars_holder.update('self', master_module)
+            # class 层: 只提供 'self'. 同一个 master_module 复用同一个 frame, 使同一个
+            # 类中的方法能共享 VarsHolder 的版本号.
+            frame = self.self_frames.get(master_module)
+            if frame is None:
+                frame = {'self': master_module}
+                self.self_frames[master_module] = frame
+            self.vars_holder.reset((frame,) + var_reachables)
+        else:
+            self.vars_holder.reset(var_reachables)
     
     # ------------------------------------------------
     
     def main(self, ast_line):
         """
         ARGS:
-            ast_line: [(obj_type, obj_val), ...]
+            ast_line: [(obj_kind, obj_val), ...]
         
         IN: ast_line
             self.vars_holder
         OT: self.vars_holder (updated)
             module_called: list. [module, ...]
         
-        caller: src.module_analyser.ModuleAnalyser#analyse_line
+        NOTE: 每次调用都会重新编译 ast_line. 对于 AstTable 中的行, 请使用
+            AstTable#get_program() 取得已编译的行程序, 再调用 self.run().
         """
-        out = []
-        for i in ast_line:
-            obj_type, obj_val = i[0], i[1]
-            # lk.loga(obj_type, obj_val)
-            # obj_type: str. e.g. "<class '_ast.Call'>"
-            # obj_val: str/dict. e.g. '__name__', {'os': 'os'}, ...
-            method = self.support_methods.get(obj_type, self.do_nothing)
-            res = method(obj_val)
-            if res:
-                if isinstance(res, list):
-                    out.extend(res)
-                else:
-                    out.append(res)
-        return out
-    
-    # ------------------------------------------------ support_methods
-    
-    @staticmethod
-    def do_nothing(data):
-        # lk.logt('[TEMPRINT]', 'nothing todo', data)
-        # return ''
-        pass
+        return self.run(compile_line(ast_line))
     
-    def parse_arg(self, arg):
+    def run(self, program):
         """
-        IN: arg: str. 函数的参数.
-                e.g.
-                    source = `def main(prjdir, pyfile)`
-                    -> arg1 = 'prjdir', arg2 = 'pyfile' (调用者将会分两次传入)
-        OT: self.vars_holder (updated)
-            f'<{arg}>': str. 一个特殊的 module, 由 '<>' 包裹的.
-        """
-        module = self.vars_holder.get(arg)
-        if module is None:
-            module = f'<{arg}>'
-        self.vars_holder.update(arg, module)
-        return module
-    
-    def parse_assign(self, assign: dict):
-        """
-        IN: assign: {(str)new_var: (str)known_var}. e.g. {"init": "Init"}
-                键是新变量, 值来自 self.assign_reachables.
-        OT: (updated) self.assign_reached
-        """
-        out = []
-        for new_var, known_var in assign.items():
-            if known_var.startswith('self.'):
-                module = known_var.replace(
-                    'self', self.vars_holder.get('self'), 1
-                )  # 'self.main' -> 'src.app.Init.main'
-            else:
-                module = self.vars_holder.get(known_var.split('.', 1)[0])
-            lk.logt('[D0505]', known_var, module)
-            """
-            case 1:
-                known_var = "downloader.Downloader"
-                -> known_var.split('.', 1)[0] = "downloader"
-                -> module = 'testflight.downloader'
-            """
-            if module is None:
-                # source_line = 'a = os.path(...)' -> known_var = 'os.path'
-                continue
-            else:
-                out.append(module)
-                # source_line = 'a = Init()' -> known_var = 'Init'
-                self.vars_holder.update(new_var, module)
-        return out
-    
-    def parse_attribute(self, call: str) -> str:
-        """
-        IN: call: e.g. 'downloader.Downloader'
-                call 的值是类似于 module 的写法, 可以按照点号切成多个片段, 其中第一个片段是
-                var, 可在 self.vars_holder 中发现它, 进而得到它的真实 module; 其余则是
-                该 module 级别以下的调用, 简单加在该 module 末尾即可, 即 'downloader
-                .Downloader' -> self.assign_reached: {'downloader': 'testflight
-                .downloader'} -> 'testflight.downloader' -> 'testflight
-                .downloader.Downloader' -> 更新到 self.call_chain 中.
-        OT: (updated) self.call_chain
+        执行一行的行程序. 如果设置了 self.memo, 先尝试从中取得结果.
+        
+        ARGS:
+            program: ((op, ...), ...). see src.ast_analyser.compile_line()
+        OT: module_called: list. [module, ...]
+        
+        caller: src.module_analyser.ModuleAnalyser#analyse_module
         """
+        memo = self.memo
+        if memo is None:
+            return self.execute(program)
         
-        if call.startswith('self.'):
-            module = call.replace(
-                'self', self.vars_holder.get('self'), 1
-            )  # 'self.main' -> 'src.app.Init.main'
-        else:
-            if '.' in call:
-                head, tail = call.split('.', 1)
-            else:
-                head, tail = call, ''
-            module = self.vars_holder.get(head)
+        version = self.vars_holder.version
+        key = (version, program)
+        out = memo.get(key)
+        if out is not None:
+            return list(out)
         
-            lk.logt('[D0521]', call, module)
-            
-            if module is None:
-                # var = 'os'
-                return ''
-            else:
-                # var = 'downloader.Downloader'
-                if tail:
-                    module += '.' + tail
-        return module
+        out = self.execute(program)
+        if self.vars_holder.version == version:
+            memo.put(key, tuple(out))
+        return out
     
-    def parse_call(self, call: str):
+    def execute(self, program):
         """
-        IN: data: e.g. 'child_method'
-        OT: (updated) self.call_chain
+        解释执行一行的行程序.
         
-        NOTE: parse_call 与 parse_attribute 方法无区别.
+        IN: program
+            self.vars_holder
+            self.top_module
+        OT: self.vars_holder (updated)
+            module_called: list. [module, ...]
         """
-        if '.' in call:
-            head, tail = call.split('.', 1)
-        else:
-            head, tail = call, ''
-        
-        module = self.vars_holder.get(head)
+        out = []
+        get = self.vars_holder.get
+        update = self.vars_holder.update
         
-        lk.logt('[D0521]', call, module)
+        for ins in program:
+            op = ins[0]
+            if op == OP_RESOLVE:
+                # e.g. 'downloader.Downloader' -> ('downloader', '.Downloader')
+                # -> 'testflight.downloader' + '.Downloader'
+                module = get(ins[1])
+                if module is not None:
+                    module += ins[2]
+                    if module:
+                        out.append(module)
+                # else: var = 'os'
+            elif op == OP_ASSIGN:
+                # source_line = 'a = Init()' -> new_var = 'a', head = 'Init'
+                module = get(ins[2])
+                if module is not None:
+                    module += ins[3]
+                    out.append(module)
+                    update(ins[1], module)
+                # else: source_line = 'a = os.path(...)'
+            elif op == OP_ARG:
+                # source = `def main(prjdir, pyfile)` -> arg1 = 'prjdir', arg2
+                # = 'pyfile'. 未知的参数用 '<>' 包裹, e.g. '<prjdir>'.
+                module = get(ins[1])
+                if module is None:
+                    module = '<' + ins[1] + '>'
+                update(ins[1], module)
+                out.append(module)
+            elif op == OP_DEFINE:
+                # 'main' -> 'src.app.main'
+                update(ins[1], self.top_module + ins[2])
+            elif op == OP_IMPORT:
+                # {"lk_utils.lk_logger.lk": "lk"} -> {"lk": "lk_utils.lk_logger
+                # .lk"}
+                update(ins[1], ins[2])
         
-        if module is None:
-            # var = 'os'
-            return ''
-        else:
-            # var = 'downloader.Downloader'
-            if tail:
-                module += '.' + tail
-            return module
-    
-    def parse_class_def(self, data: str):
-        """
-        IN: data: str. e.g. "Init"
-        OT: "src.app.Init"
-        """
-        var = data  # -> 'Init'
-        module = self.top_module + '.' + var
-        # | module = self.top_module + '.' + var + '.__init__'
-        # | -> 'src.app.Init.__init__'
-        lk.logt('[D3903]', 'parse_class_def', var, module)
-        self.vars_holder.update(var, module)
-    
-    def parse_function_def(self, data: str):
-        """
-        IN: data: str. e.g. "main"
-        OT: "src.app.main"
-        """
-        var = data  # -> 'main'
-        module = self.top_module + '.' + var  # -> 'src.app.main'
-        lk.logt('[D3902]', 'parse_function_def', var, module)
-        self.vars_holder.update(var, module)
-    
-    def parse_import(self, data: dict):
-        """
-        IN: data: dict. {module: var}. e.g. {"lk_utils.lk_logger.lk": "lk"}
-        """
-        for module, var in data.items():
-            self.vars_holder.update(var, module)
-            # update: {"lk": "lk_utils.lk_logger.lk"}
+        return out
@@ -1,21 +1,40 @@
+from bisect import bisect_left
 from os.path import abspath
 
 from lk_utils import file_sniffer
 from lk_utils.lk_logger import lk
 
 from src.assign_analyser import AssignAnalyser
-from src.line_parser import LineParser
+from src.ast_analyser import AstTable, IMPORT, IMPORT_FROM
+from src.line_parser import LineMemo, LineParser
+from src.module_index import LazyModuleIndex, ModuleIndex
+from src.prj_scanner import DEFAULT_EXCLUDES, PrjScanner, PrjSnapshot
 
 
 class ModuleHelper:
     top_module = ''
     runtime_module = ''
     
-    def __init__(self, prjdir, exclude_dirs=None):
+    def __init__(self, prjdir, exclude_dirs=None, excludes=DEFAULT_EXCLUDES,
+                 use_gitignore=True, snapshot_file=None, lazy=False):
+        """
+        ARGS:
+            prjdir
+            exclude_dirs: see self.load_prj_modules()
+            excludes, use_gitignore: see src.prj_scanner.scan_pyfiles()
+            snapshot_file: None/str. 项目扫描快照的保存路径. 指定后, 之后的运行只重新扫
+                描发生过变化的目录. see src.prj_scanner.PrjSnapshot
+            lazy: bool. 为 True 时不预先扫描 prjdir, 而是在查询时按需检查某个导入是否为
+                项目模块. see src.module_index.LazyModuleIndex
+        """
         self.prjdir = prjdir
+        self.excludes = excludes
+        self.use_gitignore = use_gitignore
+        self.snapshot_file = snapshot_file
+        self.lazy = lazy
         # self.top_module = self.get_module_by_filepath(pyfile)
         # self.runtime_module = self.top_module + '.module'
-        self.prj_modules = self.load_prj_modules(exclude_dirs)  # -> [modules]
+        self.module_index = self.load_prj_modules(exclude_dirs)
     
     def bind_file(self, pyfile):
         self.top_module = self.get_module_by_filepath(pyfile)
@@ -23,7 +42,7 @@ class ModuleHelper:
     
     # ------------------------------------------------ loads
     
-    def load_prj_modules(self, exclude_dirs=None) -> tuple:
+    def load_prj_modules(self, exclude_dirs=None) -> ModuleIndex:
         """
         获得项目所有可导入的模块路径.
 
@@ -35,54 +54,66 @@ class ModuleHelper:
         那么本方法只收录 ['src.downloader'], 不收录 ['sys'].
 
         IN: self.prjdir: str. an absolute project directory. e.g. 'D:/myprj/'
-            exclude_dirs: iterable. <- FIXME: no usage for now, and maybe
-                                        removed in the future.
-        OT: prj_modules: list. e.g. ['testflight.test_app_launcher',
-        'testflight
-                .downloader', ...]
+            self.excludes
+            self.use_gitignore
+            self.snapshot_file
+            self.lazy
+            exclude_dirs: None/iterable. 要排除的目录, 它们会在扫描时被整个剪掉.
+                e.g. ['../temp/', 'D:/myprj/dust/']
+        OT: ModuleIndex. 收录了 prj_modules, e.g. ['testflight.test_app_launcher',
+                'testflight.downloader', ...]
+                lazy 模式下为 LazyModuleIndex, 初始时为空.
         """
-        all_files = file_sniffer.findall_files(self.prjdir)
-        all_pyfiles = [x for x in all_files if x.endswith('.py')]
-        # -> ['D:/myprj/src/app.py', 'D:/myprj/src/downloader.py', ...]
-        
-        if exclude_dirs:  # DEL (2019-07-31): 效益较低. 未来将会移除.
+        excludes = list(self.excludes)
+        if exclude_dirs:
             lk.loga(exclude_dirs)
             for adir in exclude_dirs:
-                all_files = file_sniffer.findall_files(
-                    file_sniffer.prettify_dir(abspath(adir))
-                )
-                # lk.loga(all_files)
-                pyfiles = (x for x in all_files if x.endswith('.py'))
-                for f in pyfiles:
-                    all_pyfiles.remove(f)
+                adir = file_sniffer.prettify_dir(abspath(adir))
+                if adir.startswith(self.prjdir):
+                    # 转换为相对于 prjdir 的 pattern. e.g. '/dust/'
+                    excludes.append('/' + adir[len(self.prjdir):])
         
-        prj_modules = tuple(
-            self.get_module_by_filepath(x)
-            for x in all_pyfiles
+        scanner = PrjScanner(
+            self.prjdir, excludes=excludes, use_gitignore=self.use_gitignore
         )
+        
+        if self.lazy:
+            return LazyModuleIndex(self.prjdir, scanner)
+        elif self.snapshot_file:
+            snapshot = PrjSnapshot(scanner, self.snapshot_file)
+            module_index = snapshot.module_index or ModuleIndex(self.prjdir)
+            added, removed = snapshot.refresh()
+            lk.loga(len(added), len(removed))
+            for x in removed:
+                module_index.remove_pyfile(x)
+            for x in added:
+                module_index.add_pyfile(x)
+            snapshot.module_index = module_index
+            snapshot.save()
+        else:
+            module_index = ModuleIndex(self.prjdir)
+            for rdir, pyfiles, _ in scanner.walk():
+                for name in pyfiles:
+                    module_index.add_pyfile(self.prjdir + rdir + name)
+                    # -> 'D:/myprj/src/app.py'
         # -> ('src.app', 'src.downloader', ...)
         
-        lk.loga(len(all_files), len(all_pyfiles))
-        # | lk.loga(len(all_pyfiles), prj_modules)
+        lk.loga(len(module_index))
+        # | lk.loga(module_index.get_modules())
         
-        return prj_modules
+        return module_index
     
     # ------------------------------------------------ gets
     
     def get_prj_modules(self):
-        return self.prj_modules
+        return self.module_index.get_modules()
     
     def get_prj_module(self, module) -> str:
         """
-        IN: self.prj_modules: tuple
-        OT: prj_module: str
+        IN: self.module_index
+        OT: prj_module: str. 为空时说明此 module 不存在于 prj_modules.
         """
-        while module:
-            if module in self.prj_modules:
-                return module
-            else:
-                module = self.get_module_seg(module, 'l1')
-        return ''  # 说明此 module 不存在于 prj_modules.
+        return self.module_index.get_prj_module(module)
     
     def get_top_module(self):
         assert self.top_module, \
@@ -137,16 +168,15 @@ class ModuleHelper:
         IN: fpath: str. 请确保传入的是绝对路径. e.g. 'D:/myprj/src/app.py'
         OT: module: str. e.g. 'src.app'
         """
-        return fpath.replace(self.prjdir, '', 1).replace('/', '.')[:-3]
-        # fpath = 'D:/myprj/src/app.py' -> 'src.app'
+        return self.module_index.get_module(fpath)
     
     def get_pyfile_by_prj_module(self, prj_module):
-        return self.prjdir + prj_module.replace('.', '/') + '.py'
+        return self.module_index.get_pyfile(prj_module)
     
     # ------------------------------------------------ checks
     
     def is_top_module(self, module: str):
-        return module in self.prj_modules
+        return module in self.module_index
     
     @staticmethod
     def is_runtime_module(module: str):
@@ -155,16 +185,11 @@ class ModuleHelper:
     def is_prj_module(self, unknown_module: str):
         """
         IN: unknown_module
-            self.prj_modules
+            self.module_index
         OT: (<bool is_prj_module_or_not>, <str related_prj_module>)
         """
-        if unknown_module in self.prj_modules:
-            return True, unknown_module
-        for i in self.prj_modules:
-            if unknown_module.startswith(i + '.'):
-                return True, i
-        else:
-            return False, ''
+        prj_module = self.module_index.get_prj_module(unknown_module)
+        return bool(prj_module), prj_module
 
 
 class ModuleIndexing:
@@ -189,63 +214,35 @@ class ModuleIndexing:
     产生) 等.
     """
     
-    def __init__(self, module_helper: ModuleHelper, ast_tree, ast_indents):
+    def __init__(self, module_helper: ModuleHelper, ast_table: AstTable):
         """
         ARGS:
             module_helper: ModuleHelper.
-            ast_tree: dict. 用于定位和获取指定行号的抽象行信息.
-            ast_indents: dict. 用于定位和获取指定行号的缩进位置.
+            ast_table: AstTable. 用于定位和获取指定行号的抽象行信息和缩进位置.
         """
         self.module_helper = module_helper
-        self.ast_tree = ast_tree
-        self.ast_indents = ast_indents
+        self.ast_table = ast_table
         
         self.top_module = module_helper.get_top_module()
         self.runtime_module = module_helper.get_runtime_module()
-        self.prj_linos = list(ast_indents.keys())
+        self.prj_linos = ast_table.linos
     
-    def indexing_module_linos(self, master_module='', linos=None):
+    def indexing_module_linos(self):
         """
         获取 pyfile 内每个 module 对应的行号范围.
-        根据 {lino:indent} 和 ast_tree 创建 {module:linos} 的字典.
+        根据 ast_table 中的作用域树 (see src.ast_analyser.ScopeTree) 创建 {module:
+        linos} 的字典.
         注:
             1. 每个 module (无论是父子关系还是兄弟关系) 之间的范围互不重叠.
             2. AClass.__init__ 被认作 AClass
         
-        IN: master_module: str.
-                当为空时, 将使用默认值 self.top_module (e.g. 'src.app')
-                不为空时, 请注意传入的是当前要观察的 module 的上一级 module. 例如我们要编译
-                    src.app.main.child_method 所在的层级, 则 top_module 应传入 src
-                    .app.main. 用例参考: src.analyser.AssignAnalyser#update
-                    _assigns
-            linos: None/list. 您可以自定义要读取的 module 范围, 本方法会仅针对这个区间进行
-                编译.
-                例如:
-                    1 | def aaa():
-                    2 |     def bbb():      # <- start
-                    3 |         def ccc():
-                    4 |             pass
-                    5 |                     # <- end
-                    6 | def ddd():
-                    7 |     pass
-                则本方法只编译 range(2, 5) 范围内的数据, 并返回 {'src.app.aaa.bbb': [
-                2, 5], 'src.app.aaa.bbb.ccc': [3, 4]} 作为编译结果.
-                注意: 指定的范围的开始位置的缩进必须小于等于结束位置的缩进 (空行除外).
-                如果该参数为 None, 则默认使用所有行号 (`range(0, len(code_lines))`).
-            self.ast_tree: dict. {lino: [(obj_type, obj_val), ...], ...}
-                lino: int. 行号, 从 1 开始数.
-                obj_type: str. 对象类型, 例如 "<class 'FunctionDef'>" 等. 完整的支持
-                    列表参考 src.utils.ast_helper.AstHelper#eval_node().
-                obj_val: str/dict. 对象的值, 目前仅存在 str 或 dict 类型的数据.
-                    示例:
-                        (str) 'print'
-                        (dict) {'src.downloader.Downloader':
-                            'src.downloader.Downloader'} (多用于描述 Import)
-            self.ast_indents: dict. {lino: indent, ...}. 由 AstHelper#create
-                _lino_indent_dict() 提供.
-                lino: int. 行号, 从 1 开始数.
-                indent: int. 该行的列缩进位置, 为 4 的整数倍数, 如 0, 4, 8, 12 等.
+        IN: self.ast_table: AstTable. 由 src.ast_analyser.AstAnalyser#parse() 提
+                供.
+                linos: 含节点的行号, 已排序, 从 1 开始数.
+                scopes: 作用域树. 它把文件切分为互不重叠的片段, 每个片段属于一个函数或
+                    类的作用域, 或者属于模块层 (即 runtime_module).
             self.top_module: str. e.g. 'src.app'
+            self.runtime_module: str. e.g. 'src.app.module'
         OT:
             module_linos: dict. {module: [lino, ...]}
                 module: str. 模块的路径名.
@@ -261,115 +258,29 @@ class ModuleIndexing:
                 于读取该 module 对应的区间范围, 逐行分析每条语句, 并进一步发现新的调用关系,
                 以此产生裂变效应. 详见 src.analyser.VirtualRunner#main().
         """
-        if master_module == '':
-            master_module = self.top_module
-            assert linos is None
-            linos = self.prj_linos
-            # the linos are already sorted.
-        else:
-            assert linos is not None
+        lk.logd('indexing module linos', self.top_module)
         
-        lk.logd('indexing module linos', master_module)
+        scopes = self.ast_table.scopes
+        linos = self.prj_linos
         
-        # ------------------------------------------------
-        
-        # ast_defs: ast definitions
-        ast_defs = ("<class '_ast.FunctionDef'>", "<class '_ast.ClassDef'>")
-        ast_args = ("<class '_ast.arg'>",)
+        modules = scopes.get_modules(self.top_module)
         
-        indent_module_holder = {-4: self.top_module}  # format: {indent: module}
         module_linos = {}  # format: {module: linos}
         
-        last_module = ''
-        last_indent = 0
-        # last_indent 初始化值不影响方法的正常执行. 因为我们事先能保证 linos 参数的第一个
-        # lino 的 indent 一定是正常的, 而伴随着第一个 lino 的循环结尾, last_indent 就能
-        # 得到安全的更新, 因此 last_indent 的初始值无论是几都是安全的.
-        
-        for lino in linos:
-            obj_type, obj_val = self.eval_ast_line(lino)
-            # -> "<class '_ast.FunctionDef'>", 'main'
-            
-            indent = self.ast_indents.get(lino, -1)
-            parent_indent = indent - 4
-            
-            # lk.loga(lino, indent, last_module, obj_type, obj_val)
-            
-            if parent_indent in indent_module_holder:
-                parent_module = indent_module_holder[parent_indent]
-                
-                if obj_type in ast_defs:
-                    # obj_type = "<class 'FunctionDef'>", obj_val = 'main'
-                    if obj_val == '__init__':
-                        # source_code = `def __init__(self):`
-                        current_module = parent_module
-                    else:
-                        current_module = parent_module + '.' + obj_val
-                    # -> 'src.app.main'
-                elif obj_type in ast_args:
-                    current_module = last_module
-                elif indent == 0 \
-                        or last_module == self.runtime_module:
-                    current_module = self.runtime_module
-                    # | current_module = parent_module + '.module'
-                else:
-                    # indent > 0 and last_parent_module not in (
-                    # master_module, self
-                    # .runtime_module
-                    current_module = parent_module
-                
-                # update indent_module_holder
-                indent_module_holder.update({indent: current_module})
-                # -> {0: 'src.app.main'}, {4: 'src.app.main.child_method'}, ...
+        for start, stop, owner in scopes.iter_segments():
+            i = bisect_left(linos, start)
+            j = bisect_left(linos, stop) if stop is not None else len(linos)
+            if i == j:
+                continue
             
+            module = modules[owner] if owner != -1 else self.runtime_module
+            node = module_linos.get(module)
+            if node is None:
+                module_linos[module] = linos[i:j].tolist()
             else:
-                lk.loga(lino, indent, last_module)
-                indent = last_indent
-                current_module = last_module
-            """
-            case 1:
-                source_code = ```
-                    1 | def main():  # <- cursor
-                    2 |     pass
-                ```
-                indent = 0, obj_val = 'main'
-                -> indent - 4 = -4
-                -> parent_module = 'src.app'
-                -> current_module = 'src.app.main'
-            case 2:
-                source_code = ```
-                    1 | def main():
-                    2 |     def child_method():  # <- cursor
-                    3 |         pass
-                ```
-                indent = 4, obj_val = 'child_method'
-                -> indent - 4 = 0
-                -> parent_module = 'src.app.main'
-                -> current_module = 'src.app.main.child_method'
-            case 3:
-                source_code = ```
-                    1 | def main():
-                    2 |     def child_method():
-                    3 |         print('aaa', 'bbb'
-                    4 |               'ccc')  # <- cursor
-                ```
-                indent = 14, obj_val = "'ccc'"
-                -> indent - 4 = 10
-                -> 10 not in indent_module_holder.keys(), so return the fallback
-                   value: 'src.app.main.child_method'
-                -> current_module = 'src.app.main.child_method'
-            """
-            
-            # update module_linos
-            node = module_linos.setdefault(current_module, [])
-            node.append(lino)  # NOTE: the lino is in ordered
-            
-            # update last vars
-            last_module = current_module
-            last_indent = indent
+                node.extend(linos[i:j])
         
         # TEST show
-        # lk.logt('[D3421]', self.top_module, indent_module_holder)
         show_modules_lightly = tuple(
             self.module_helper.get_module_seg(x, 'r0')
             for x in module_linos
@@ -387,24 +298,23 @@ class ModuleIndexing:
         }
         """
         
-        # raise Exception  # TEST
         return module_linos
     
     def find_prj_modules(self):
         prj_modules = []
         
         # ast_imps: abstract syntax tree imports
-        ast_imps = ("<class '_ast.ImportFrom'>", "<class '_ast.Import'>")
+        ast_imps = (IMPORT_FROM, IMPORT)
         
         for lino in self.prj_linos:
             # lk.loga(lino)
             
-            obj_type, obj_val = self.eval_ast_line(lino)
-            # -> "<class '_ast.FunctionDef'>", 'main'
+            obj_kind, obj_val = self.eval_ast_line(lino)
+            # -> FUNCTION_DEF, 'main'
             
-            if obj_type in ast_imps:
+            if obj_kind in ast_imps:
                 """
-                obj_type = "<class '_ast.ImportFrom'>"
+                obj_kind = IMPORT_FROM
                 obj_val = {"lk_utils.lk_logger.lk": "lk"}
                 """
                 for module in obj_val:
@@ -417,21 +327,19 @@ class ModuleIndexing:
     # ------------------------------------------------
     
     def eval_ast_line(self, lino):
-        ast_line = self.ast_tree[lino]  # type: list
-        # ast_line is type of list, assert it not empty.
-        assert ast_line
-        # here we only take its first element. which will show us method or
-        # class definitions.
-        return ast_line[0]
+        # here we only take the first element of the line. which will show us
+        # method or class definitions.
+        return self.ast_table.get_head(lino)
 
 
 class ModuleAnalyser:
     line_parser = None
+    assign_analyser = None
+    module_linos = None
     
-    def __init__(self, module_helper: ModuleHelper, ast_tree, ast_indents):
+    def __init__(self, module_helper: ModuleHelper, ast_table: AstTable):
         self.module_helper = module_helper
-        self.ast_tree = ast_tree
-        self.ast_indents = ast_indents
+        self.ast_table = ast_table
         
         self.module_calls = {}  # format: {module: [call, ...], ...}
     
@@ -442,34 +350,54 @@ class ModuleAnalyser:
                 A: self.module_calls (updated)
                 B: prj_modules
         """
-        module_indexing = ModuleIndexing(
-            self.module_helper, self.ast_tree, self.ast_indents
-        )
+        module_indexing = ModuleIndexing(self.module_helper, self.ast_table)
         prj_modules = module_indexing.find_prj_modules()
-        module_linos = module_indexing.indexing_module_linos()
-        
-        assign_analyser = AssignAnalyser(
-            self.module_helper, self.ast_tree, self.ast_indents
-        )
-        self.line_parser = LineParser(
-            self.module_helper.get_top_module(),
-            assign_analyser.top_assigns
-        )
+        self.prepare(module_indexing)
         
         # ------------------------------------------------
         
-        for module, linos in module_linos.items():
-            var_reachables, parent_module = assign_analyser \
-                .indexing_assign_reachables(
-                module, module_linos
-            )
-            self.line_parser.reset(var_reachables, parent_module)
-            self.analyse_module(module, linos)
+        for module in self.module_linos:
+            self.analyse_scope(module)
+        
+        lk.logt('[I3262]', self.line_parser.memo.get_stats())
         
         # ------------------------------------------------
         
         return self.module_calls, prj_modules
     
+    def prepare(self, module_indexing=None):
+        """
+        建立 module_linos, assign_analyser 和 line_parser. 之后便可以通过 self
+        .analyse_scope() 单独分析 pyfile 中的任意一个 module.
+        
+        注意: 调用前需要先对该 pyfile 调用 ModuleHelper#bind_file(). 准备完成后,
+        self 不再依赖 module_helper 所绑定的文件, 因此可以与其他 pyfile 的
+        ModuleAnalyser 交替使用. see src.app.ScopeRunner
+        """
+        if module_indexing is None:
+            module_indexing = ModuleIndexing(self.module_helper, self.ast_table)
+        self.module_linos = module_indexing.indexing_module_linos()
+        
+        self.assign_analyser = AssignAnalyser(
+            self.module_helper, self.ast_table
+        )
+        self.line_parser = LineParser(
+            self.module_helper.get_top_module(),
+            self.assign_analyser.top_assigns,
+            LineMemo()
+        )
+    
+    def analyse_scope(self, module):
+        """
+        IN: module: str. 必须是 self.module_linos 中的键. e.g. 'src.app.Init.main'
+        OT: calls: tuple. [module, ...]
+        """
+        var_reachables, parent_module = self.assign_analyser \
+            .indexing_assign_reachables(module)
+        self.line_parser.reset(var_reachables, parent_module)
+        self.analyse_module(module, self.module_linos[module])
+        return self.module_calls[module]
+    
     def analyse_module(self, module, linos):
         """
         发现该 module 下的与其他 module 之间的调用关系.
@@ -482,8 +410,8 @@ class ModuleAnalyser:
         related_calls = []
         
         for lino in linos:
-            ast_line = self.ast_tree[lino]
-            module_called = self.analyse_line(ast_line)
+            program = self.ast_table.get_program(lino)
+            module_called = self.analyse_line(program)
             # lk.logt('[D3233]', module_called)
             for m in module_called:
                 if m not in related_calls:
@@ -492,5 +420,5 @@ class ModuleAnalyser:
         lk.logt('[I3259]', related_calls)
         self.module_calls.update({module: tuple(related_calls)})
     
-    def analyse_line(self, ast_line):
-        return self.line_parser.main(ast_line)
+    def analyse_line(self, program):
+        return self.line_parser.run(program)
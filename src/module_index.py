@@ -0,0 +1,187 @@
+import os
+
+
+class ModuleIndex:
+    """
+    项目模块索引. 按点号片段组织为前缀树 (trie), 并维护 module 与 pyfile 的双向映射.
+    
+    前缀树使查询 "一个导入路径属于哪个项目模块" 的代价只与路径的片段数有关, 而与项目模块的总数
+    无关.
+    
+    data format:
+        self.trie: {segment: node, ...}
+            node 的结构与 self.trie 相同, 若该节点本身是一个项目模块, 则额外包含键 '',
+            其值为完整的 module.
+            e.g. {'src': {'app': {'': 'src.app'}, 'writer': {'': 'src.writer'}}}
+        self.module_to_pyfile: {module: pyfile}
+            e.g. {'src.app': 'D:/myprj/src/app.py'}
+        self.pyfile_to_module: {pyfile: module}
+    """
+    
+    def __init__(self, prjdir):
+        """
+        ARGS:
+            prjdir: str. an absolute project directory. e.g. 'D:/myprj/'
+        """
+        self.prjdir = prjdir
+        self.trie = {}
+        self.module_to_pyfile = {}
+        self.pyfile_to_module = {}
+    
+    def __contains__(self, module):
+        return module in self.module_to_pyfile
+    
+    def __len__(self):
+        return len(self.module_to_pyfile)
+    
+    def get_modules(self):
+        return tuple(self.module_to_pyfile)
+    
+    # ------------------------------------------------ updates
+    
+    def add_pyfile(self, pyfile):
+        """
+        IN: pyfile: str. 请确保传入的是 prjdir 下的绝对路径. e.g. 'D:/myprj/src/app.py'
+        OT: module: str. e.g. 'src.app'
+        """
+        module = self.pyfile_to_module.get(pyfile)
+        if module is not None:
+            return module
+        
+        module = self.calc_module(pyfile)
+        self.module_to_pyfile[module] = pyfile
+        self.pyfile_to_module[pyfile] = module
+        
+        node = self.trie
+        for seg in module.split('.'):
+            node = node.setdefault(seg, {})
+        node[''] = module
+        
+        return module
+    
+    def remove_pyfile(self, pyfile):
+        module = self.pyfile_to_module.pop(pyfile, None)
+        if module is None:
+            return
+        del self.module_to_pyfile[module]
+        
+        # 删除末端节点的模块标记, 并自下而上清理已经为空的节点.
+        segs = module.split('.')
+        path = [self.trie]
+        for seg in segs:
+            path.append(path[-1][seg])
+        del path[-1]['']
+        for i in range(len(segs), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][segs[i - 1]]
+    
+    # ------------------------------------------------ queries
+    
+    def get_prj_module(self, module: str) -> str:
+        """
+        查询 module 所属的项目模块, 即 module 的最长的, 属于项目模块的前缀.
+        
+        IN: module: str. e.g. 'testflight.downloader.Downloader'
+        OT: prj_module: str. e.g. 'testflight.downloader'. 如果 module 不属于任何项目模
+                块, 则返回空字符串.
+        """
+        prj_module = ''
+        node = self.trie
+        for seg in module.split('.'):
+            node = node.get(seg)
+            if node is None:
+                break
+            prj_module = node.get('', prj_module)
+        return prj_module
+    
+    def get_module(self, pyfile):
+        """
+        IN: pyfile: str. e.g. 'D:/myprj/src/app.py'
+        OT: module: str. e.g. 'src.app'
+        """
+        module = self.pyfile_to_module.get(pyfile)
+        if module is None:
+            # pyfile 不在索引中 (例如刚创建的文件), 直接按路径计算.
+            module = self.calc_module(pyfile)
+        return module
+    
+    def get_pyfile(self, module):
+        """
+        IN: module: str. e.g. 'src.app'
+        OT: pyfile: str. e.g. 'D:/myprj/src/app.py'
+        """
+        pyfile = self.module_to_pyfile.get(module)
+        if pyfile is None:
+            pyfile = self.prjdir + module.replace('.', '/') + '.py'
+        return pyfile
+    
+    def calc_module(self, pyfile):
+        return pyfile.replace(self.prjdir, '', 1).replace('/', '.')[:-3]
+        # pyfile = 'D:/myprj/src/app.py' -> 'src.app'
+
+
+class LazyModuleIndex(ModuleIndex):
+    """
+    按需发现项目模块. 不预先扫描 prjdir, 而是在查询时检查 prjdir 下是否存在对应的 pyfile, 并
+    缓存检查结果. 只有真正被查询过的模块才会进入索引.
+    
+    适用于大型项目中只分析少数入口的情况: 启动时不需要遍历整个项目, 之后也只接触实际可达的文
+    件.
+    
+    data format:
+        self.probed: {module: bool}. module 是否对应一个项目中的 pyfile.
+        self.probed_dirs: {module: bool}. module 是否对应 prjdir 下的一个目录.
+        其余同 ModuleIndex, 但只包含已被发现的模块.
+    """
+    
+    def __init__(self, prjdir, scanner):
+        """
+        ARGS:
+            prjdir
+            scanner: src.prj_scanner.PrjScanner. 用于保证与全量扫描时收录的文件一致 (
+                同样遵循 excludes 和 .gitignore).
+        """
+        super().__init__(prjdir)
+        self.scanner = scanner
+        self.probed = {}
+        self.probed_dirs = {}
+    
+    def __contains__(self, module):
+        return self.probe(module)
+    
+    def probe(self, module):
+        found = self.probed.get(module)
+        if found is None:
+            relpath = module.replace('.', '/') + '.py'
+            found = os.path.isfile(self.prjdir + relpath) \
+                and self.scanner.is_included(relpath)
+            if found:
+                self.add_pyfile(self.prjdir + relpath)
+            self.probed[module] = found
+        return found
+    
+    def probe_dir(self, module):
+        found = self.probed_dirs.get(module)
+        if found is None:
+            found = os.path.isdir(self.prjdir + module.replace('.', '/'))
+            self.probed_dirs[module] = found
+        return found
+    
+    def get_prj_module(self, module: str) -> str:
+        """
+        从短到长检查 module 的各个前缀. 一旦某个前缀既不是目录, 更长的前缀就不可能是项目模块
+        了, 因此对外部模块 (如 'os.path.join') 通常只需要检查第一个片段.
+        
+        IN: module: str. e.g. 'testflight.downloader.Downloader'
+        OT: prj_module: str. e.g. 'testflight.downloader'
+        """
+        prj_module = ''
+        prefix = ''
+        for seg in module.split('.'):
+            prefix = prefix + '.' + seg if prefix else seg
+            if self.probe(prefix):
+                prj_module = prefix
+            if not self.probe_dir(prefix):
+                break
+        return prj_module
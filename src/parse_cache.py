@@ -0,0 +1,181 @@
+import os
+import pickle
+from hashlib import sha1
+from sys import version_info
+
+from lk_utils.lk_logger import lk
+
+from src.ast_analyser import ANALYSER_VERSION, AstAnalyser, AstTable
+
+
+class ParseCache:
+    """
+    AstAnalyser 解析结果 (AstTable) 的磁盘缓存.
+    
+    缓存以文件内容寻址: 键由 pyfile 的内容, ANALYSER_VERSION 和 python 版本共同计算得到,
+    因此文件未改动时直接读取缓存, 改动后自然失效, 不需要额外的失效逻辑.
+    
+    data format:
+        cache_dir/{key}.pkl
+            key: str. sha1 hex digest.
+        self.entries: {key: [size, mtime]}
+            mtime 兼作最近使用时间, 命中时会被刷新. 超出 max_size 时按 mtime 从旧到新淘
+            汰.
+    """
+    suffix = '.pkl'
+    
+    def __init__(self, cache_dir, max_size=256 * 1024 * 1024):
+        """
+        ARGS:
+            cache_dir: str. 缓存目录, 不存在时会自动创建.
+            max_size: int. 缓存目录的总大小上限 (字节).
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        self.entries = {}
+        self.total_size = 0
+        self.refresh()
+    
+    def refresh(self):
+        """
+        重新读取缓存目录的条目. 其他进程写入过缓存后 (see src.app.VirtualRunner
+        #main()), 调用本方法使 self.entries 与磁盘保持一致.
+        """
+        self.entries = self.load_entries()
+        self.total_size = sum(x[0] for x in self.entries.values())
+        if self.total_size > self.max_size:
+            self.evict()
+    
+    def load_entries(self):
+        entries = {}
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(self.suffix) and entry.is_file():
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:  # 被其他进程淘汰
+                        continue
+                    key = entry.name[:-len(self.suffix)]
+                    entries[key] = [stat.st_size, stat.st_mtime]
+        return entries
+    
+    # ------------------------------------------------
+    
+    def load(self, pyfile) -> AstTable:
+        """
+        读取 pyfile 的 AstTable. 缓存未命中时解析该文件并写入缓存.
+        """
+        with open(pyfile, 'rb') as f:
+            key = self.make_key(f.read())
+        
+        ast_table = self.read(key)
+        if ast_table is None:
+            self.misses += 1
+            ast_table = AstAnalyser(pyfile).parse()
+            self.write(key, ast_table)
+        else:
+            self.hits += 1
+        return ast_table
+    
+    @staticmethod
+    def make_key(data: bytes):
+        tag = '{}|{}.{}|'.format(
+            ANALYSER_VERSION, version_info[0], version_info[1]
+        ).encode()
+        return sha1(tag + data).hexdigest()
+    
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+    
+    def read(self, key):
+        if key not in self.entries:
+            return None
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                ast_table = pickle.load(f)
+        except Exception as e:
+            # 缓存文件损坏或被外部删除, 当作未命中处理.
+            lk.logt('[W2714]', 'broken cache entry', path, e)
+            self.remove(key)
+            return None
+        # 刷新 mtime, 作为最近使用时间.
+        try:
+            os.utime(path)
+            self.entries[key][1] = os.path.getmtime(path)
+        except FileNotFoundError:
+            # 读取后被其他进程淘汰 (各进程的缓存互不协调). 读到的结果仍然有效.
+            self.forget(key)
+        return ast_table
+    
+    def write(self, key, ast_table: AstTable):
+        path = self.get_path(key)
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'wb') as f:
+            pickle.dump(ast_table, f, pickle.HIGHEST_PROTOCOL)
+        # 先写临时文件再替换, 避免多个进程同时写入时读到半个文件.
+        os.replace(temp, path)
+        
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            # 写入后被其他进程淘汰, 不再记录这个条目.
+            if key in self.entries:
+                self.forget(key)
+            return
+        if key in self.entries:
+            self.total_size -= self.entries[key][0]
+        self.entries[key] = [stat.st_size, stat.st_mtime]
+        self.total_size += stat.st_size
+        
+        if self.total_size > self.max_size:
+            self.evict()
+    
+    def forget(self, key):
+        """
+        只从 self.entries 中移除条目, 不删除缓存文件.
+        """
+        size, _ = self.entries.pop(key)
+        self.total_size -= size
+    
+    def remove(self, key):
+        self.forget(key)
+        try:
+            os.remove(self.get_path(key))
+        except FileNotFoundError:
+            pass
+    
+    def evict(self):
+        """
+        按最近使用时间从旧到新删除缓存, 直到总大小不超过 max_size.
+        """
+        for key in sorted(self.entries, key=lambda k: self.entries[k][1]):
+            if self.total_size <= self.max_size:
+                break
+            self.remove(key)
+            self.evictions += 1
+    
+    # ------------------------------------------------
+    
+    def merge_stats(self, stats: dict):
+        """
+        汇总其他进程中的计数器增量. see src.app.VirtualRunner#main().
+        """
+        self.hits += stats['hits']
+        self.misses += stats['misses']
+        self.evictions += stats['evictions']
+    
+    def get_stats(self):
+        return {
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'evictions' : self.evictions,
+            'entries'   : len(self.entries),
+            'total_size': self.total_size,
+        }
@@ -0,0 +1,207 @@
+"""
+调用路径查询: 两个 module 之间最短的调用路径, 以及前 k 短的不同调用路径.
+
+usage (在 src 的上级目录下运行):
+    python -m src.path_query <graph> <source> <target> [-k 3]
+    graph: 调用图文件 (src.app.main() 的 graph_file 参数, e.g. temp/graph.bin), 或平
+        铺视图的 json 文件 (e.g. temp/out2.json).
+    source, target: 完整的 module 名, 或者它的唯一的后缀, e.g. 'app.module' 可以匹配
+        'testflight.app.module'.
+"""
+import heapq
+from argparse import ArgumentParser
+
+from src.call_graph import CallGraph, CsrGraph
+
+
+def shortest_path(graph, source, target, banned_nodes=(), banned_edges=()):
+    """
+    双向广度优先搜索: 每次从正向 (get_callees) 和反向 (get_callers) 中边界较小的一侧扩
+    展一整层, 两侧相遇时即得到最短路径. 与单向搜索相比, 访问的节点数约为其平方根.
+    
+    ARGS:
+        graph: CallGraph/CsrGraph.
+        source, target: int. 节点 id.
+        banned_nodes: set. 不能经过的节点.
+        banned_edges: set. {(caller, callee), ...}. 不能经过的边.
+    OT: None/[id, ...]. 从 source 到 target 的节点序列 (包括两端). 不可达时为 None.
+    """
+    if source == target:
+        return [source]
+    prev = {source: None}  # 正向搜索树, {node: 它的调用者}
+    succ = {target: None}  # 反向搜索树, {node: 它的被调用者}
+    front, back = [source], [target]
+    
+    while front and back:
+        meet = None
+        best = None
+        if len(front) <= len(back):
+            layer = []
+            for u in front:
+                for v in graph.get_callees(u):
+                    if v in prev or v in banned_nodes or (u, v) in banned_edges:
+                        continue
+                    prev[v] = u
+                    layer.append(v)
+                    if v in succ:
+                        # 同一层中可能有多个相遇点, 取反向一侧更短的.
+                        length = _count(succ, v)
+                        if best is None or length < best:
+                            meet, best = v, length
+            front = layer
+        else:
+            layer = []
+            for v in back:
+                for u in graph.get_callers(v):
+                    if u in succ or u in banned_nodes or (u, v) in banned_edges:
+                        continue
+                    succ[u] = v
+                    layer.append(u)
+                    if u in prev:
+                        length = _count(prev, u)
+                        if best is None or length < best:
+                            meet, best = u, length
+            back = layer
+        
+        if meet is not None:
+            path = []
+            x = meet
+            while x is not None:
+                path.append(x)
+                x = prev[x]
+            path.reverse()
+            x = succ[meet]
+            while x is not None:
+                path.append(x)
+                x = succ[x]
+            return path
+    return None
+
+
+def _count(tree, x):
+    n = 0
+    while tree[x] is not None:
+        x = tree[x]
+        n += 1
+    return n
+
+
+def iter_shortest_paths(graph, source, target, k=None):
+    """
+    Yen 算法: 按长度从短到长逐个产出 source 到 target 的不同的无环调用路径.
+    
+    第 n 条路径的每个前缀 (root) 之后, 禁止已找到的路径在该前缀后走过的边, 并禁止经过
+    前缀中的节点, 再用 shortest_path() 求出一条偏离路径 (spur path). 所有偏离路径作为候
+    选, 每次取出最短的一条.
+    
+    ARGS:
+        k: None/int. 最多产出的路径数, 为 None 时产出全部 (路径数可能随图的规模指数增
+            长, 调用方应及时停止迭代).
+    OT: iter[[id, ...]]
+    """
+    if k is not None and k < 1:
+        return
+    path = shortest_path(graph, source, target)
+    if path is None:
+        return
+    found = [path]
+    yield path
+    
+    seen = {tuple(path)}
+    candidates = []  # heap: [(length, seq, path), ...]
+    seq = 0
+    while k is None or len(found) < k:
+        last = found[-1]
+        for i in range(len(last) - 1):
+            root = last[:i + 1]
+            banned_edges = {(p[i], p[i + 1]) for p in found
+                            if len(p) > i + 1 and p[:i + 1] == root}
+            spur = shortest_path(graph, root[-1], target, set(root[:-1]),
+                                 banned_edges)
+            if spur is None:
+                continue
+            path = root[:-1] + spur
+            if tuple(path) not in seen:
+                seen.add(tuple(path))
+                heapq.heappush(candidates, (len(path), seq, path))
+                seq += 1
+        if not candidates:
+            break
+        path = heapq.heappop(candidates)[2]
+        found.append(path)
+        yield path
+
+
+# ------------------------------------------------ cli
+
+def load_graph(file):
+    """
+    OT: (graph, find, get_name)
+            graph: CallGraph/CsrGraph.
+            find: callable. 接收 module 名, 返回 id (不存在时为 -1).
+            get_name: callable. 接收 id, 返回 module 名.
+    """
+    if file.endswith('.json'):
+        from lk_utils.read_and_write_basic import read_json
+        graph = CallGraph()
+        get_id = graph.symbols.get_id
+        for caller, calls in read_json(file).items():
+            graph.record(get_id(caller), [get_id(x) for x in calls])
+        return graph, graph.symbols.find, graph.symbols.get_name
+    graph = CsrGraph.load(file)
+    return graph, graph.find, graph.get_name
+
+
+def resolve(graph, find, get_name, name):
+    """
+    OT: [id, ...]. 完全匹配 name 的节点, 没有时为以 '.' + name 结尾的所有节点.
+    """
+    id_ = find(name)
+    if id_ > 0:
+        return [id_]
+    suffix = '.' + name
+    return [i for i in range(1, graph.node_count())
+            if get_name(i).endswith(suffix)]
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        prog='python -m src.path_query',
+        description='查询两个 module 之间最短的调用路径.'
+    )
+    parser.add_argument('graph', help='调用图文件 (.bin) 或平铺视图 (.json)')
+    parser.add_argument('source', help='调用者, e.g. app.module')
+    parser.add_argument('target', help='被调用者, e.g. db.flush')
+    parser.add_argument('-k', type=int, default=1,
+                        help='输出前 k 短的不同路径 (默认为 1)')
+    args = parser.parse_args(argv)
+    if args.k < 1:
+        parser.error('-k must be at least 1')
+    
+    graph, find, get_name = load_graph(args.graph)
+    ends = []
+    for name in (args.source, args.target):
+        ids = resolve(graph, find, get_name, name)
+        if len(ids) != 1:
+            parser.error('{} matches {} modules{}'.format(
+                name, len(ids),
+                ': ' + ', '.join(get_name(x) for x in ids) if ids else ''
+            ))
+        ends.extend(ids)
+    
+    count = 0
+    for path in iter_shortest_paths(graph, ends[0], ends[1], args.k):
+        count += 1
+        print('[{}] ({} calls) {}'.format(
+            count, len(path) - 1, ' -> '.join(get_name(x) for x in path)
+        ))
+    if not count:
+        print('{} does not reach {}'.format(
+            get_name(ends[0]), get_name(ends[1])
+        ))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
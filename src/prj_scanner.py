@@ -0,0 +1,434 @@
+"""
+项目扫描器: 找出 prjdir 下所有需要收录的 pyfile.
+
+与 lk_utils.file_sniffer.findall_files 不同, 本模块在遍历的过程中就把不需要的目录剪掉 (例如
+.git, 虚拟环境, node_modules 等), 而不是先列出全部文件再过滤.
+
+patterns 的写法:
+    与 .gitignore 的写法相同 (只支持常用的部分).
+    'foo': 匹配任意层级下名为 foo 的文件或目录.
+    'foo/': 同上, 但只匹配目录.
+    '/foo', 'a/foo': 含有 '/' 的 pattern 相对于 prjdir (或 .gitignore 所在目录) 匹配.
+    '*', '?', '[abc]': 不跨越 '/' 的通配符.
+    '**': 跨越任意层目录的通配符. e.g. 'a/**/b', '**/tests'
+    '!foo': 仅在 .gitignore 中有效, 表示重新包含之前被排除的路径.
+"""
+import os
+import pickle
+import re
+
+DEFAULT_EXCLUDES = (
+    '.git/', '.hg/', '.svn/', '.idea/', '.vscode/', '__pycache__/',
+    'node_modules/', '.venv/', 'venv/', '.tox/', '.nox/', '.mypy_cache/',
+    '.pytest_cache/', '*.egg-info/',
+)
+
+
+class PathRule:
+    __slots__ = ('base', 'regex', 'negate', 'dir_only')
+    
+    def __init__(self, pattern: str, base=''):
+        """
+        ARGS:
+            pattern: str. see the module docstring.
+            base: str. pattern 生效的目录, 相对于 prjdir, 以 '/' 结尾或为空字符串.
+        """
+        self.base = base
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        
+        if '/' in pattern:
+            # 含有 '/' 时相对于 base 匹配.
+            pattern = pattern.lstrip('/')
+            prefix = ''
+        else:
+            # 否则可以匹配任意层级.
+            prefix = '(?:.*/)?'
+        self.regex = re.compile(prefix + self.translate(pattern) + '$')
+    
+    @staticmethod
+    def translate(pattern):
+        out = []
+        i, n = 0, len(pattern)
+        while i < n:
+            c = pattern[i]
+            if pattern.startswith('**/', i):
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            elif pattern.startswith('**', i):
+                out.append('.*')
+                i += 2
+                continue
+            elif c == '*':
+                out.append('[^/]*')
+            elif c == '?':
+                out.append('[^/]')
+            elif c == '[':
+                j = pattern.find(']', i + 1)
+                if j == -1:
+                    out.append(re.escape(c))
+                else:
+                    chars = pattern[i + 1:j]
+                    if chars.startswith('!'):
+                        chars = '^' + chars[1:]
+                    out.append('[' + chars + ']')
+                    i = j
+            else:
+                out.append(re.escape(c))
+            i += 1
+        return ''.join(out)
+    
+    def match(self, relpath: str, is_dir: bool):
+        """
+        IN: relpath: str. 相对于 prjdir 的路径, 不以 '/' 结尾. e.g. 'src/app.py'
+        OT: bool
+        """
+        if self.dir_only and not is_dir:
+            return False
+        if self.base:
+            if not relpath.startswith(self.base):
+                return False
+            relpath = relpath[len(self.base):]
+        return bool(self.regex.match(relpath))
+
+
+def load_gitignore(adir, base):
+    """
+    IN: adir: str. 目录的绝对路径, 以 '/' 结尾.
+        base: str. 该目录相对于 prjdir 的路径, 以 '/' 结尾或为空字符串.
+    OT: [PathRule, ...]. 目录下没有 .gitignore 时返回空列表.
+    """
+    try:
+        with open(adir + '.gitignore', 'r', encoding='utf-8-sig') as f:
+            lines = f.read().split('\n')
+    except (FileNotFoundError, NotADirectoryError, UnicodeDecodeError):
+        return []
+    rules = []
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('\\'):
+            line = line[1:]
+        rules.append(PathRule(line, base))
+    return rules
+
+
+def is_ignored(rules, relpath, is_dir):
+    """
+    依次检查 rules, 以最后一条匹配的规则为准.
+    """
+    ignored = False
+    for rule in rules:
+        if rule.negate == ignored and rule.match(relpath, is_dir):
+            ignored = not rule.negate
+    return ignored
+
+
+class PrjScanner:
+    """
+    按目录逐层扫描 prjdir. 每个目录的扫描结果只与该目录本身及其祖先目录的 .gitignore 有关,
+    因此既可以整棵树遍历 (see self.walk()), 也可以单独重新扫描某一个目录 (see src
+    .prj_scanner.PrjSnapshot).
+    """
+    
+    def __init__(self, prjdir, includes=('*.py',), excludes=DEFAULT_EXCLUDES,
+                 use_gitignore=True):
+        """
+        ARGS: see scan_pyfiles()
+        """
+        self.prjdir = prjdir
+        self.includes = tuple(includes)
+        self.excludes = tuple(excludes)
+        self.use_gitignore = use_gitignore
+        
+        self.include_rules = [PathRule(x) for x in includes]
+        self.exclude_rules = [PathRule(x) for x in excludes]
+        self.ignore_rules = {}  # format: {rdir: [PathRule, ...]}
+        self.included_dirs = {}  # format: {rdir: bool}. see is_dir_included()
+    
+    def get_config(self):
+        return self.includes, self.excludes, self.use_gitignore
+    
+    def get_ignore_rules(self, rdir):
+        """
+        IN: rdir: str. 相对于 prjdir 的目录, 以 '/' 结尾或为空字符串. e.g. 'src/'
+        OT: [PathRule, ...]. rdir 及其所有祖先目录下的 .gitignore 规则.
+        """
+        if not self.use_gitignore:
+            return []
+        rules = self.ignore_rules.get(rdir)
+        if rules is None:
+            if rdir:
+                parent = rdir[:-1].rpartition('/')[0]
+                parent = parent + '/' if parent else ''
+                rules = self.get_ignore_rules(parent)
+            else:
+                rules = []
+            rules = rules + load_gitignore(self.prjdir + rdir, rdir)
+            self.ignore_rules[rdir] = rules
+        return rules
+    
+    def scan_dir(self, rdir):
+        """
+        只扫描 rdir 这一层.
+        
+        IN: rdir: str. 相对于 prjdir 的目录, 以 '/' 结尾或为空字符串. e.g. 'src/'
+        OT: (pyfiles, subdirs)
+                pyfiles: [name, ...]. 需要收录的文件名. e.g. ['app.py', ...]
+                subdirs: [name, ...]. 需要继续遍历的子目录名. e.g. ['utils', ...]
+                两者都按名称排序.
+        """
+        adir = self.prjdir + rdir
+        ignore_rules = self.get_ignore_rules(rdir)
+        
+        try:
+            with os.scandir(adir) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except (PermissionError, FileNotFoundError, NotADirectoryError):
+            return [], []
+        
+        pyfiles, subdirs = [], []
+        for entry in entries:
+            relpath = rdir + entry.name
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if not is_dir and not entry.is_file():
+                continue
+            if any(x.match(relpath, is_dir) for x in self.exclude_rules):
+                continue
+            if ignore_rules and is_ignored(ignore_rules, relpath, is_dir):
+                continue
+            if is_dir:
+                if os.path.exists(entry.path + '/pyvenv.cfg'):
+                    # 虚拟环境的目录名不一定是 venv, 通过 pyvenv.cfg 识别.
+                    continue
+                subdirs.append(entry.name)
+            elif any(x.match(relpath, False) for x in self.include_rules):
+                pyfiles.append(entry.name)
+        return pyfiles, subdirs
+    
+    def is_included(self, relpath):
+        """
+        不遍历整棵树, 判断 relpath 是否会被 self.walk() 收录.
+        
+        IN: relpath: str. 相对于 prjdir 的文件路径. e.g. 'src/app.py'
+        OT: bool
+        """
+        rdir, _, name = relpath.rpartition('/')
+        rdir = rdir + '/' if rdir else ''
+        if not self.is_dir_included(rdir):
+            return False
+        if not any(x.match(relpath, False) for x in self.include_rules):
+            return False
+        if any(x.match(relpath, False) for x in self.exclude_rules):
+            return False
+        return not is_ignored(self.get_ignore_rules(rdir), relpath, False)
+    
+    def is_dir_included(self, rdir):
+        """
+        IN: rdir: str. 相对于 prjdir 的目录, 以 '/' 结尾或为空字符串. e.g. 'src/'
+        OT: bool. rdir 及其所有祖先目录都没有被剪掉时为 True.
+        """
+        if not rdir:
+            return True
+        included = self.included_dirs.get(rdir)
+        if included is None:
+            path = rdir[:-1]
+            parent = path.rpartition('/')[0]
+            parent = parent + '/' if parent else ''
+            ignore_rules = self.get_ignore_rules(parent)
+            included = self.is_dir_included(parent) \
+                and not any(x.match(path, True) for x in self.exclude_rules) \
+                and not is_ignored(ignore_rules, path, True) \
+                and not os.path.exists(self.prjdir + rdir + 'pyvenv.cfg')
+            self.included_dirs[rdir] = included
+        return included
+    
+    def walk(self, rdir=''):
+        """
+        OT: generator. yield (rdir, pyfiles, subdirs). see self.scan_dir()
+        """
+        stack = [rdir]
+        while stack:
+            rdir = stack.pop()
+            pyfiles, subdirs = self.scan_dir(rdir)
+            yield rdir, pyfiles, subdirs
+            # 逆序入栈, 使目录按名称顺序出栈.
+            stack.extend(rdir + x + '/' for x in reversed(subdirs))
+
+
+def scan_pyfiles(prjdir, includes=('*.py',), excludes=DEFAULT_EXCLUDES,
+                 use_gitignore=True):
+    """
+    IN: prjdir: str. an absolute project directory. e.g. 'D:/myprj/'
+        includes: iterable. 文件需要匹配其中至少一个 pattern 才会被收录.
+        excludes: iterable. 匹配其中任一 pattern 的文件或目录都会被跳过, 目录会在遍历时被
+            整个剪掉.
+        use_gitignore: bool. 是否遵循各级目录下的 .gitignore.
+    OT: generator. yield pyfile. e.g. 'D:/myprj/src/app.py'
+    """
+    scanner = PrjScanner(prjdir, includes, excludes, use_gitignore)
+    for rdir, pyfiles, _ in scanner.walk():
+        for name in pyfiles:
+            yield prjdir + rdir + name
+
+
+class PrjSnapshot:
+    """
+    持久化的项目扫描快照. 之后的运行只需重新扫描发生过变化的目录.
+    
+    目录中新增, 删除或重命名文件时, 目录本身的 mtime 会改变. 因此 self.refresh() 只对快照中的
+    每个目录执行 stat, mtime 不变的目录直接沿用快照中的结果, 不再 scandir.
+    
+    data format:
+        self.dirs: {rdir: [dir_mtime, gitignore_mtime, pyfiles, subdirs]}
+            rdir: str. 相对于 prjdir 的目录, 以 '/' 结尾或为空字符串.
+            dir_mtime: int. 目录的 st_mtime_ns.
+            gitignore_mtime: int. 目录下 .gitignore 的 st_mtime_ns, 不存在时为 0.
+            pyfiles, subdirs: see PrjScanner#scan_dir()
+        self.module_index: None/ModuleIndex. 与快照一同保存的模块索引, 由调用者维护.
+            see src.module_analyser.ModuleHelper#load_prj_modules()
+    """
+    version = 1
+    
+    def __init__(self, scanner: PrjScanner, snapshot_file):
+        self.scanner = scanner
+        self.snapshot_file = snapshot_file
+        
+        self.dirs = {}
+        self.module_index = None
+        self.load()
+    
+    def load(self):
+        try:
+            with open(self.snapshot_file, 'rb') as f:
+                data = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return
+        if data['version'] != self.version \
+                or data['prjdir'] != self.scanner.prjdir \
+                or data['config'] != self.scanner.get_config():
+            # 扫描规则变了, 旧快照作废.
+            return
+        self.dirs = data['dirs']
+        self.module_index = data['module_index']
+    
+    def save(self):
+        data = {
+            'version'     : self.version,
+            'prjdir'      : self.scanner.prjdir,
+            'config'      : self.scanner.get_config(),
+            'dirs'        : self.dirs,
+            'module_index': self.module_index,
+        }
+        temp = '{}.{}.tmp'.format(self.snapshot_file, os.getpid())
+        with open(temp, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self.snapshot_file)
+    
+    # ------------------------------------------------
+    
+    def refresh(self):
+        """
+        使快照与磁盘保持一致.
+        
+        OT: (added, removed)
+                added: [pyfile, ...]. 新出现的 pyfile. 没有可用的快照时即为全部 pyfile.
+                removed: [pyfile, ...]. 已经不存在 (或已被排除) 的 pyfile.
+                调用者应先处理 removed 再处理 added.
+        """
+        added, removed = [], []
+        
+        stack = ['']
+        while stack:
+            rdir = stack.pop()
+            old = self.dirs.get(rdir)
+            mtimes = self.stat(rdir)
+            
+            if mtimes is None:
+                # 目录已被删除.
+                removed.extend(self.drop(rdir))
+                continue
+            if old is None or old[1] != mtimes[1]:
+                # 新目录, 或者 .gitignore 变了 (会影响整棵子树), 重新扫描整棵子树.
+                if old is not None:
+                    removed.extend(self.drop(rdir))
+                    self.scanner.ignore_rules = {
+                        k: v for k, v in self.scanner.ignore_rules.items()
+                        if not k.startswith(rdir)
+                    }
+                added.extend(self.build(rdir))
+                continue
+            
+            if old[0] != mtimes[0]:
+                pyfiles, subdirs = self.scanner.scan_dir(rdir)
+                adir = self.scanner.prjdir + rdir
+                old_pyfiles = set(old[2])
+                new_pyfiles = set(pyfiles)
+                removed.extend(adir + x for x in old[2] if x not in new_pyfiles)
+                added.extend(adir + x for x in pyfiles if x not in old_pyfiles)
+                for x in old[3]:
+                    if x not in subdirs:
+                        removed.extend(self.drop(rdir + x + '/'))
+                self.dirs[rdir] = [mtimes[0], mtimes[1], pyfiles, subdirs]
+            
+            stack.extend(rdir + x + '/' for x in reversed(self.dirs[rdir][3]))
+        
+        return added, removed
+    
+    def stat(self, rdir):
+        """
+        OT: None/(dir_mtime, gitignore_mtime). 目录不存在时返回 None.
+        """
+        adir = self.scanner.prjdir + rdir
+        try:
+            dir_mtime = os.stat(adir).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        try:
+            gitignore_mtime = os.stat(adir + '.gitignore').st_mtime_ns
+        except FileNotFoundError:
+            gitignore_mtime = 0
+        return dir_mtime, gitignore_mtime
+    
+    def build(self, rdir):
+        """
+        扫描 rdir 整棵子树并记录到快照.
+        
+        OT: [pyfile, ...]
+        """
+        out = []
+        stack = [rdir]
+        while stack:
+            x = stack.pop()
+            # 与 self.refresh() 相同, 先 stat 再扫描. 扫描期间新增的文件会使目录的
+            # mtime 晚于快照中记录的值, 下次 refresh() 时会被重新扫描.
+            mtimes = self.stat(x) or (0, 0)
+            pyfiles, subdirs = self.scanner.scan_dir(x)
+            self.dirs[x] = [mtimes[0], mtimes[1], pyfiles, subdirs]
+            adir = self.scanner.prjdir + x
+            out.extend(adir + name for name in pyfiles)
+            stack.extend(x + name + '/' for name in reversed(subdirs))
+        return out
+    
+    def drop(self, rdir):
+        """
+        从快照中删除 rdir 整棵子树.
+        
+        OT: [pyfile, ...]. 被删除的目录中记录过的 pyfile.
+        """
+        out = []
+        stack = [rdir]
+        while stack:
+            x = stack.pop()
+            node = self.dirs.pop(x, None)
+            if node is None:
+                continue
+            adir = self.scanner.prjdir + x
+            out.extend(adir + name for name in node[2])
+            stack.extend(x + name + '/' for name in node[3])
+        return out
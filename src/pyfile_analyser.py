@@ -4,22 +4,37 @@ from src.module_analyser import ModuleAnalyser, ModuleHelper
 
 class PyfileAnalyser:
     
-    def __init__(self, module_helper: ModuleHelper):
+    def __init__(self, module_helper: ModuleHelper, parse_cache=None):
+        """
+        ARGS:
+            module_helper
+            parse_cache: None/ParseCache. 为 None 时每次都重新解析 pyfile.
+        """
         self.module_helper = module_helper
+        self.parse_cache = parse_cache
     
     def main(self, pyfile: str):
         """
         IN:
         OT: prj_modules: list
         """
+        return self.load(pyfile).main()
+    
+    def prepare(self, pyfile: str) -> ModuleAnalyser:
+        """
+        只做分析前的准备, 不分析任何 module. 由调用者决定分析哪些 module.
+        see src.module_analyser.ModuleAnalyser#analyse_scope()
+        """
+        module_analyser = self.load(pyfile)
+        module_analyser.prepare()
+        return module_analyser
+    
+    def load(self, pyfile: str) -> ModuleAnalyser:
         self.module_helper.bind_file(pyfile)
         
-        ast_analyser = AstAnalyser(pyfile)
-        ast_tree = ast_analyser.main()
-        ast_indents = ast_analyser.get_lino_indent_dict()
-        
-        module_analyser = ModuleAnalyser(
-            self.module_helper, ast_tree, ast_indents
-        )
+        if self.parse_cache is None:
+            ast_table = AstAnalyser(pyfile).parse()
+        else:
+            ast_table = self.parse_cache.load(pyfile)
         
-        return module_analyser.main()
+        return ModuleAnalyser(self.module_helper, ast_table)
@@ -0,0 +1,227 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+# ------------------------------------------------ binary format
+
+"""
+可达性索引的二进制格式 (小端序, 所有区段都按 8 字节对齐):
+    header: <4sIII> magic, version, n_nodes, n_comps
+    row_offsets: uint64 * (n_comps + 1). 第 c 个分量的位集位于 bits[row_offsets[c]:
+        row_offsets[c + 1]].
+    comp_of: int32 * n_nodes.
+    member_offsets: uint32 * (n_comps + 1).
+    members: int32 * n_nodes.
+    bits: bytes, 末尾补齐到 8 字节.
+各区段的含义 see ReachabilityIndex.
+"""
+MAGIC = b'PCRI'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+
+# BITS[b]: 字节 b 中为 1 的位. 用于把位集还原为分量.
+BITS = tuple(tuple(i for i in range(8) if b >> i & 1) for b in range(256))
+
+
+class ReachabilityIndex:
+    """
+    基于调用图缩点 (see src.condensation.Condensation) 的传递闭包索引. 每个分量保存一个
+    位集, 记录它直接或间接调用的所有分量, 因此 "A 能否到达 B" 只需要检查一个位.
+    
+    缩点的分量按逆拓扑序编号, 分量 c 能到达的分量的编号都不大于 c, 所以 c 的位集只需要
+    c + 1 位 (即 c // 8 + 1 个字节), 整个索引是一个下三角矩阵, 约占 n_comps ** 2 / 16
+    个字节. 构建时按编号从小到大, 把被调用者的位集按位或到调用者上.
+    
+    可达是严格的: 一个 module 能到达它自己, 当且仅当它在环上 (互相调用或自调用).
+    
+    data format:
+        self.row_offsets: array('Q'). 长度为分量数 + 1.
+        self.bits: bytearray. 各分量的位集, 第 c 个分量的第 d 位为 1 表示 c 能到达 d.
+        self.comp_of, self.member_offsets, self.members: 同 Condensation.
+    """
+    
+    def __init__(self, condensation=None):
+        """
+        ARGS:
+            condensation: None/Condensation. 为 None 时创建空的索引, 供 load() 使用.
+        """
+        self.mm = None
+        if condensation is None:
+            return
+        cond = condensation
+        self.comp_of = cond.comp_of
+        self.member_offsets = cond.member_offsets
+        self.members = cond.members
+        
+        # 以 int 作为位集计算闭包, 之后逐行写入 self.bits.
+        n = len(cond)
+        self.row_offsets = array('Q', [0]) * (n + 1)
+        self.bits = bytearray()
+        rows = [0] * n
+        for c in range(n):
+            row = 1 << c if cond.is_cyclic(c) else 0
+            for d in cond.get_callees(c):
+                row |= rows[d] | 1 << d
+            rows[c] = row
+            self.bits += row.to_bytes((c >> 3) + 1, 'little')
+            self.row_offsets[c + 1] = len(self.bits)
+    
+    def __len__(self):
+        """
+        OT: int. 分量的数量.
+        """
+        return len(self.row_offsets) - 1
+    
+    # ------------------------------------------------ queries
+    
+    def reaches_component(self, a, b):
+        """
+        IN: a, b: int. 分量.
+        OT: bool. 分量 a 能否到达分量 b.
+        """
+        if b > a:
+            return False
+        return bool(self.bits[self.row_offsets[a] + (b >> 3)] >> (b & 7) & 1)
+    
+    def reaches(self, a, b):
+        """
+        IN: a, b: int. 节点 id.
+        OT: bool. a 能否直接或间接调用 b. O(1).
+        """
+        if not (0 <= a < len(self.comp_of) and 0 <= b < len(self.comp_of)):
+            return False
+        return self.reaches_component(self.comp_of[a], self.comp_of[b])
+    
+    def iter_components(self, comp):
+        """
+        OT: iter[int]. comp 能到达的分量, 从小到大.
+        """
+        start = self.row_offsets[comp]
+        row = self.bits[start:self.row_offsets[comp + 1]]
+        for i, byte in enumerate(row):
+            if byte:
+                base = i << 3
+                for bit in BITS[byte]:
+                    yield base + bit
+    
+    def iter_members(self, comps):
+        for c in comps:
+            yield from self.members[
+                self.member_offsets[c]:self.member_offsets[c + 1]
+            ]
+    
+    def get_reachable(self, id_):
+        """
+        OT: iter[int]. id_ 直接或间接调用的节点.
+        """
+        if not 0 <= id_ < len(self.comp_of):
+            return iter(())
+        return self.iter_members(self.iter_components(self.comp_of[id_]))
+    
+    def get_reaching(self, id_, sources=None):
+        """
+        批量查询直接或间接调用 id_ 的节点.
+        
+        ARGS:
+            id_: int.
+            sources: None/iterable. 候选的节点 (例如所有入口). 为 None 时查询全部节点.
+        OT: [int, ...]. sources 中能到达 id_ 的节点, 保持 sources 的顺序.
+        """
+        if not 0 <= id_ < len(self.comp_of):
+            return []
+        target = self.comp_of[id_]
+        if sources is None:
+            # 只有编号不小于 target 的分量才可能到达它.
+            comps = (c for c in range(target, len(self))
+                     if self.reaches_component(c, target))
+            return list(self.iter_members(comps))
+        return [x for x in sources if self.reaches(x, id_)]
+    
+    def get_reachable_from(self, sources):
+        """
+        OT: {int, ...}. 从 sources 中的任一节点出发能到达的节点.
+        """
+        union = 0
+        for x in sources:
+            if 0 <= x < len(self.comp_of):
+                c = self.comp_of[x]
+                union |= int.from_bytes(self.bits[
+                    self.row_offsets[c]:self.row_offsets[c + 1]
+                ], 'little')
+        bits = union.to_bytes((union.bit_length() + 7) >> 3, 'little')
+        comps = ((i << 3) + bit
+                 for i, byte in enumerate(bits) if byte
+                 for bit in BITS[byte])
+        return set(self.iter_members(comps))
+    
+    # ------------------------------------------------ serialization
+    
+    def dump(self, path):
+        """
+        保存为单个二进制文件, 通常放在调用图的旁边 (e.g. 'graph.bin' -> 'graph.reach'
+        ). 可以通过 load() 以 mmap 的方式读取.
+        """
+        sections = (self.row_offsets, self.comp_of, self.member_offsets,
+                    self.members)
+        if sys.byteorder != 'little':
+            sections = tuple(array(x.typecode, x) for x in sections)
+            for x in sections:
+                x.byteswap()
+        
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.comp_of), len(self)))
+            for x in sections:
+                f.write(x.tobytes())
+                f.write(b'\0' * (-len(x) * x.itemsize % 8))
+            f.write(self.bits)
+            f.write(b'\0' * (-len(self.bits) % 8))
+        os.replace(temp, path)
+    
+    @classmethod
+    def load(cls, path):
+        self = cls()
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self.mm)
+        
+        magic, version, n, n_comps = HEADER.unpack_from(buf)
+        if magic != MAGIC or version != VERSION:
+            buf.release()
+            self.mm.close()
+            raise ValueError(
+                'not a reachability index file (v{})'.format(VERSION), path
+            )
+        
+        pos = HEADER.size
+        sections = []
+        for fmt, size, count in (('Q', 8, n_comps + 1), ('i', 4, n),
+                                 ('I', 4, n_comps + 1), ('i', 4, n)):
+            x = buf[pos:pos + count * size].cast(fmt)
+            if sys.byteorder != 'little':
+                x = array(fmt, x)
+                x.byteswap()
+            sections.append(x)
+            pos += count * size + (-count * size % 8)
+        (self.row_offsets, self.comp_of, self.member_offsets,
+         self.members) = sections
+        self.bits = buf[pos:pos + self.row_offsets[n_comps]]
+        buf.release()
+        return self
+    
+    def close(self):
+        for k in ('row_offsets', 'comp_of', 'member_offsets', 'members',
+                  'bits'):
+            x = self.__dict__.pop(k, None)
+            if isinstance(x, memoryview):
+                x.release()
+        if self.mm:
+            self.mm.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *_):
+        self.close()
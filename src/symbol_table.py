@@ -0,0 +1,76 @@
+from array import array
+from sys import intern
+
+
+class SymbolTable:
+    """
+    module 名的符号表. 把点号分隔的 module 名映射为整数 id, 按片段组织为前缀树.
+    
+    调用图中的 module 名有大量相同的前缀 (如 'testflight.app.main', 'testflight.app
+    .main.child_method'), 前缀树中每个片段只保存一次. 图的内部结构 (see src.writer
+    .Writer) 只保存 id, 需要输出时再通过 get_name() 还原为字符串.
+    
+    id 从 1 开始连续分配, 0 是根节点 (空名字). 每个前缀本身也会分配一个 id, 例如加入
+    'src.app.main' 时, 'src' 和 'src.app' 也会得到 id.
+    
+    data format:
+        self.children: [{segment: id}, ...]. 下标是 id.
+        self.parents: array('i'). 下标是 id, 根节点的父节点为 -1.
+        self.segments: [segment, ...]. 下标是 id, 其中的字符串都已 intern.
+    """
+    
+    def __init__(self):
+        self.children = [{}]
+        self.parents = array('i', [-1])
+        self.segments = ['']
+    
+    def __len__(self):
+        return len(self.segments) - 1
+    
+    def get_id(self, name: str) -> int:
+        """
+        获取 name 的 id, 不存在时创建.
+        
+        IN: name: str. e.g. 'testflight.app.main'
+        OT: int
+        """
+        node = 0
+        for seg in name.split('.'):
+            child = self.children[node].get(seg)
+            if child is None:
+                child = len(self.segments)
+                self.children[node][intern(seg)] = child
+                self.children.append({})
+                self.parents.append(node)
+                self.segments.append(intern(seg))
+            node = child
+        return node
+    
+    def find(self, name: str) -> int:
+        """
+        OT: int. name 的 id, 不存在时返回 -1.
+        """
+        node = 0
+        for seg in name.split('.'):
+            node = self.children[node].get(seg, -1)
+            if node == -1:
+                break
+        return node
+    
+    def get_name(self, id_: int) -> str:
+        """
+        IN: id_: int. e.g. 3
+        OT: str. e.g. 'testflight.app.main'
+        """
+        segs = []
+        while id_ > 0:
+            segs.append(self.segments[id_])
+            id_ = self.parents[id_]
+        return '.'.join(reversed(segs))
+    
+    def get_parent(self, id_: int) -> int:
+        """
+        OT: int. 上一级 module 的 id, e.g. 'src.app.main' -> 'src.app'. 顶层的 module
+                返回 0.
+        """
+        return self.parents[id_]
@@ -0,0 +1,111 @@
+import heapq
+import os
+from collections import deque
+
+
+class Worklist:
+    """
+    待分析的 pyfile 工作表. 用于 src.app.VirtualRunner#main() 发现和调度新的 pyfile.
+    
+    每个 pyfile 只会被加入一次 (通过 self.visited 集合以 O(1) 判重). 取出的顺序由 order 决
+    定:
+        'bfs': 先进先出, 按 import 层级由浅到深. 这是默认的顺序.
+        'dfs': 后进先出, 沿着一条 import 链先走到底.
+        'priority': 按 priority 给出的键从小到大.
+    
+    wave (波次) 表示 pyfile 距离启动文件的 import 层级. 启动文件为第 0 波, 分析第 n 波的文件
+    时发现的新文件为第 n + 1 波.
+    
+    data format:
+        self.visited: {pyfile, ...}
+        self.queue: deque([(pyfile, wave), ...])
+            priority 模式下为堆: [(key, seq, pyfile, wave), ...]
+        self.waves: [count, ...]. 第 n 个元素是第 n 波发现的文件数.
+    """
+    orders = ('bfs', 'dfs', 'priority')
+    
+    def __init__(self, order='bfs', priority='dir'):
+        """
+        ARGS:
+            order: str. 'bfs'/'dfs'/'priority'
+            priority: str/callable. 仅在 order 为 'priority' 时有效.
+                'dir': 按 (所在目录, 文件名) 排序, 同一目录下的文件会被连续分析.
+                'size': 按文件大小从小到大排序.
+                callable: 接收 pyfile 并返回可比较的键.
+        """
+        if order not in self.orders:
+            raise ValueError(
+                'the `order` must be one of {}'.format(self.orders)
+            )
+        self.order = order
+        
+        if order == 'priority':
+            if priority == 'dir':
+                self.get_priority = os.path.split
+            elif priority == 'size':
+                self.get_priority = os.path.getsize
+            elif callable(priority):
+                self.get_priority = priority
+            else:
+                raise ValueError(
+                    'the `priority` must be "dir", "size" or a callable'
+                )
+            self.queue = []
+        else:
+            self.queue = deque()
+        
+        self.visited = set()
+        self.waves = []
+        self.seq = 0  # 保证 priority 模式下相同键的文件按加入顺序取出.
+        self.popped = 0
+    
+    def __bool__(self):
+        return bool(self.queue)
+    
+    def __len__(self):
+        return len(self.queue)
+    
+    def push(self, pyfile, wave=0) -> bool:
+        """
+        OT: bool. True 表示 pyfile 是新发现的文件并已加入工作表, False 表示已存在.
+        """
+        if pyfile in self.visited:
+            return False
+        self.visited.add(pyfile)
+        
+        while len(self.waves) <= wave:
+            self.waves.append(0)
+        self.waves[wave] += 1
+        
+        if self.order == 'priority':
+            heapq.heappush(
+                self.queue, (self.get_priority(pyfile), self.seq, pyfile, wave)
+            )
+        else:
+            self.queue.append((pyfile, wave))
+        self.seq += 1
+        return True
+    
+    def pop(self):
+        """
+        OT: (pyfile, wave)
+        """
+        if self.order == 'bfs':
+            item = self.queue.popleft()
+        elif self.order == 'dfs':
+            item = self.queue.pop()
+        else:
+            item = heapq.heappop(self.queue)[2:]
+        self.popped += 1
+        return item
+    
+    def get_stats(self):
+        """
+        OT: {'order': str, 'visited': int, 'popped': int, 'waves': [int, ...]}
+        """
+        return {
+            'order'  : self.order,
+            'visited': len(self.visited),
+            'popped' : self.popped,
+            'waves'  : list(self.waves),
+        }
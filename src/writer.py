@@ -1,94 +1,516 @@
 from lk_utils.lk_logger import lk
 
+from src.call_graph import CallGraph, iter_callers
+from src.condensation import Condensation
+from src.edge_sink import EdgeSink
+from src.json_stream import JsonStream
+from src.path_query import iter_shortest_paths, shortest_path
+from src.reachability import ReachabilityIndex
+from src.symbol_table import SymbolTable
+
+
+# 层叠视图中的标记
+CALLBACK_HELL = '[◆CALLBACK_HELL◆]'  # 回调成环, 不再展开
+MAX_DEPTH = '[◆MAX_DEPTH◆]'  # 超过最大深度, 不再展开
+MAX_FANOUT = '[◆MAX_FANOUT◆]'  # 超过最大扇出, 其值为被省略的被调用者的数量
+CYCLE = '[◆CYCLE◆]'  # 缩点后成环的分量, 后接它的成员
+
+# Writer#walk() 产出的事件
+ENTER, LEAF, EXIT = range(3)
+
 
 class Writer:
+    """
+    记录 module 之间的调用关系, 并输出为平铺视图和层叠视图.
+    
+    内部只保存 module 的 id (see src.symbol_table.SymbolTable), 输出时才还原为字符串.
+    
+    层叠视图有两种模式:
+        'tree': 每次到达一个 module 都完整地展开它的子树. 存在大量菱形调用 (多条路径
+            到达同一个 module) 时, 输出的体积随调用层数指数增长.
+        'dag': 每个子树只展开一次, 之后再到达同一个 module 时, 改为指向首次展开位置的
+            引用 `{"$ref": "#/runtime_module/module1/..."}` (JSON Pointer). 经
+            expand_refs() 还原后与 'tree' 模式的输出相同.
     
-    def __init__(self):
+    collapse_cycles 为 True 时, 层叠视图在调用图的强连通分量缩点 (see src.condensation
+    .Condensation) 上展开: 互相调用的 module 合并为一个节点 '[◆CYCLE◆] a, b, ...', 每
+    个环只报告一次, 不再出现 CALLBACK_HELL.
+    
+    data format:
+        self.graph: src.call_graph.CallGraph. 平铺视图, 即每个调用者的被调用者.
+        self.stacks: [module_id, ...]. 当前展开的路径.
+        self.depths: {module_id: index}. 与 self.stacks 同步, 用于 O(1) 地检查回调和
+            查找它在 self.stacks 中的位置.
+        self.refs: {module_id: (pointer, height)}. 'dag' 模式下已展开的子树.
+            pointer: str/tuple. 子树在层叠视图中的位置. 为节省内存, 展开时先保存为
+                链表 (segment, parent_cell), 首次被引用时才拼接为字符串.
+                e.g. '#/testflight.app.module/testflight.app.main'
+            height: int. 子树的层数. 只有不超过最大深度时才能被引用.
+        self.condensation: None/Condensation. self.graph 的缩点, 在 condense() 中按需
+            计算, record() 之后失效.
+        self.reachability: None/ReachabilityIndex. 缩点上的传递闭包, 同上.
+    """
+    
+    def __init__(self, symbols=None, view_mode='tree', max_depth=None,
+                 max_fanout=None, collapse_cycles=False,
+                 cascade_file='../temp/out.json',
+                 tile_file='../temp/out2.json', edge_file=None,
+                 graph_file=None):
+        """
+        ARGS:
+            symbols: None/SymbolTable. 为 None 时新建一个.
+            view_mode: str. 'tree'/'dag'. 层叠视图的模式.
+            max_depth: None/int. 层叠视图的最大深度 (runtime_module 的被调用者为第 1
+                层). 位于最大深度且还有被调用者的 module 标记为 MAX_DEPTH.
+            max_fanout: None/int. 每个 module 最多展开的被调用者的数量, 其余的被省略,
+                并在同一层记录 {MAX_FANOUT: 被省略的数量}.
+            collapse_cycles: bool. 是否在缩点后的调用图上展开层叠视图.
+            cascade_file, tile_file: None/str. show() 输出层叠视图和平铺视图的路径,
+                以 '.gz' 结尾时以 gzip 压缩. 为 None 时不输出. see src.json_stream
+                .JsonStream.
+            edge_file: None/str. 在 record() 时实时输出调用关系的 NDJSON 文件. see src
+                .edge_sink.EdgeSink.
+            graph_file: None/str. show() 保存调用图的二进制文件, 可以通过 src
+                .call_graph.CsrGraph 以 mmap 的方式读取, 或作为 src.path_query 的输
+                入. 为 None 时不保存.
+        """
+        if view_mode not in ('tree', 'dag'):
+            raise ValueError('the `view_mode` must be "tree" or "dag"')
+        self.symbols = SymbolTable() if symbols is None else symbols
+        self.view_mode = view_mode
+        self.max_depth = max_depth
+        self.max_fanout = max_fanout
+        self.collapse_cycles = collapse_cycles
+        self.cascade_file = cascade_file
+        self.tile_file = tile_file
+        self.graph_file = graph_file
+        self.sink = EdgeSink(edge_file) if edge_file else None
         self.stacks = []
+        self.depths = {}
+        self.refs = {}
         
-        self.tile_view = {}  # 平铺视图
-        self.cascade_view = {}  # 层叠视图
+        self.graph = CallGraph(self.symbols)  # 平铺视图
+        self.cascade_view = {}  # 层叠视图, 由 build() 在内存中构建
+        self.condensation = None
+        self.reachability = None
     
     def record(self, caller: str, call_chain: list):
-        self.tile_view.update({caller: call_chain})
+        get_id = self.symbols.get_id
+        self.graph.record(get_id(caller), (get_id(x) for x in call_chain))
+        self.condensation = self.reachability = None
+        if self.sink:
+            self.sink.record(caller, call_chain)
+    
+    def finish_file(self, pyfile):
+        """
+        通知 self.sink 一个 pyfile 的所有 module 都已经 record 完毕.
+        """
+        if self.sink:
+            self.sink.finish_file(pyfile)
+    
+    def close(self):
+        """
+        分析正常结束时调用, 写入 self.sink 的 'done' 事件并关闭文件.
+        """
+        if self.sink:
+            self.sink.close()
+            self.sink = None
+    
+    def condense(self):
+        """
+        OT: Condensation.
+        """
+        if self.condensation is None:
+            self.condensation = Condensation(self.graph)
+        return self.condensation
+    
+    def get_reachability(self):
+        """
+        OT: ReachabilityIndex.
+        """
+        if self.reachability is None:
+            self.reachability = ReachabilityIndex(self.condense())
+        return self.reachability
+    
+    def reaches(self, caller: str, callee: str) -> bool:
+        """
+        OT: bool. caller 能否直接或间接调用 callee. 查询本身是 O(1) 的, 首次查询时需要
+                建立可达性索引.
+        """
+        find = self.symbols.find
+        return self.get_reachability().reaches(find(caller), find(callee))
+    
+    def get_reachable(self, module: str):
+        """
+        OT: [module, ...]. module 直接或间接调用的 module.
+        """
+        get_name = self.symbols.get_name
+        ids = self.get_reachability().get_reachable(self.symbols.find(module))
+        return [get_name(x) for x in ids]
+    
+    def get_reaching(self, module: str, sources=None):
+        """
+        IN: module: str.
+            sources: None/iterable. 候选的 module (例如所有入口), 为 None 时查询全部.
+        OT: [module, ...]. sources 中直接或间接调用 module 的 module.
+        """
+        find, get_name = self.symbols.find, self.symbols.get_name
+        if sources is not None:
+            sources = [find(x) for x in sources]
+        ids = self.get_reachability().get_reaching(find(module), sources)
+        return [get_name(x) for x in ids]
+    
+    def get_cycles(self):
+        """
+        OT: [[module, ...], ...]. 互相调用 (包括自调用) 的 module 群, 每个只出现一次.
+        """
+        get_name = self.symbols.get_name
+        return [[get_name(x) for x in members]
+                for members in self.condense().cycles()]
+    
+    def get_callers(self, module: str):
+        """
+        IN: module: str. e.g. 'src.writer.Writer.record'
+        OT: [module, ...]. 直接调用 module 的 module, 已去重, 按记录的顺序.
+        """
+        get_name = self.symbols.get_name
+        callers = self.graph.get_callers(self.symbols.find(module))
+        return [get_name(x) for x in dict.fromkeys(callers)]
+    
+    def get_fan_in(self, module: str) -> int:
+        """
+        OT: int. 直接调用 module 的 module 的数量.
+        """
+        callers = self.graph.get_callers(self.symbols.find(module))
+        return len(set(callers))
+    
+    def iter_callers(self, module: str, max_depth=None):
+        """
+        直接或间接调用 module 的 module, 按调用距离由近到远逐个产出. see src
+        .call_graph.iter_callers.
+        
+        OT: iter[(module, depth)]. e.g. [('src.app.VirtualRunner.main', 1),
+                ('src.app.main', 2), ...]
+        """
+        get_name = self.symbols.get_name
+        for caller, depth in iter_callers(
+                self.graph, self.symbols.find(module), max_depth
+        ):
+            yield get_name(caller), depth
+    
+    def find_path(self, source: str, target: str):
+        """
+        IN: source, target: str. e.g. 'src.app.module', 'src.writer.Writer.show'
+        OT: None/[module, ...]. 最短的调用路径, 包括两端. 不可达时为 None. see src
+                .path_query.shortest_path.
+        """
+        find, get_name = self.symbols.find, self.symbols.get_name
+        source, target = find(source), find(target)
+        if source == -1 or target == -1:
+            return None
+        path = shortest_path(self.graph, source, target)
+        return path and [get_name(x) for x in path]
+    
+    def find_paths(self, source: str, target: str, k=3):
+        """
+        OT: iter[[module, ...]]. 前 k 短的不同调用路径, 按长度从短到长. see src
+                .path_query.iter_shortest_paths.
+        """
+        find, get_name = self.symbols.find, self.symbols.get_name
+        source, target = find(source), find(target)
+        if source == -1 or target == -1:
+            return
+        for path in iter_shortest_paths(self.graph, source, target, k):
+            yield [get_name(x) for x in path]
+    
+    def get_component_name(self, comp):
+        """
+        OT: str. 缩点后的节点在层叠视图中的名字. 成环的分量为 '[◆CYCLE◆] a, b, ...',
+                否则为它唯一的成员的 module 名.
+        """
+        cond = self.condense()
+        members = cond.get_members(comp)
+        if cond.is_cyclic(comp):
+            return '{} {}'.format(CYCLE, ', '.join(
+                self.symbols.get_name(x) for x in members
+            ))
+        return self.symbols.get_name(members[0])
+    
+    def get_tile_view(self):
+        """
+        OT: {module: [call1, call2, ...]}. 还原为字符串的平铺视图.
+        """
+        get_name = self.symbols.get_name
+        return {
+            get_name(caller): [
+                get_name(x) for x in self.graph.get_callees(caller)
+            ]
+            for caller in self.graph.callers()
+        }
     
     def show(self, runtime_module):
         """
-        IN: self.tile_view: dict. {module: [call1, call2, ...]}
+        把层叠视图和平铺视图以流的方式写入 self.cascade_file 和 self.tile_file. 层叠视图
+        一边展开一边写入, 不在内存中构建, 因此内存占用只与调用链的深度有关, 与层叠视图的
+        大小无关.
+        
+        IN: self.graph: 平铺视图. 还原为字符串后为 {module: [call1, call2, ...]}
                 e.g. res/sample/pycallchain_tile_view.json
-        OT: self.cascade_view: dict. {runtime_module: {module1: {module11: {...
-                }, module12: {...}, ...}}}
+        OT: self.cascade_file: 层叠视图. {runtime_module: {module1: {module11: {
+                ...}, module12: {...}, ...}}}
                 e.g. res/sample/pycallchain_cascade_view.json
+            self.tile_file: 平铺视图.
+            self.graph_file: 调用图的二进制文件. see src.call_graph.CallGraph#dump()
         """
-        node = self.cascade_view.setdefault(runtime_module, {})
-        calls = self.tile_view.get(runtime_module)
-        self.recurse(node, calls)
+        if self.cascade_file:
+            with JsonStream(self.cascade_file) as out:
+                out.begin()
+                out.begin(runtime_module)
+                for event, name, value in self.walk(runtime_module):
+                    if event == ENTER:
+                        out.begin(name)
+                    elif event == LEAF:
+                        out.item(name, value)
+                    else:
+                        out.end()
+                out.end()
+                out.end()
         
         lk.logt('[D3619]', self.stacks)
-        # lk.logt('[I3316]', self.cascade_view)
+        if self.collapse_cycles:
+            lk.logt('[I3624]', self.get_cycles())
+        
+        if self.tile_file:
+            get_name = self.symbols.get_name
+            with JsonStream(self.tile_file) as out:
+                out.begin()
+                for caller in self.graph.callers():
+                    out.item(get_name(caller), [
+                        get_name(x) for x in self.graph.get_callees(caller)
+                    ])
+                out.end()
+        
+        if self.graph_file:
+            self.graph.dump(self.graph_file)
+    
+    def build(self, node: dict, runtime_module: str):
+        """
+        在内存中构建 runtime_module 的层叠视图, 适用于较小的调用图. see walk().
         
-        # TEST output
-        from lk_utils.read_and_write_basic import write_json
-        write_json(self.cascade_view, '../temp/out.json')
-        write_json(self.tile_view, '../temp/out2.json')
+        IN: node: dict. 通常是 self.cascade_view.setdefault(runtime_module, {}).
+        """
+        nodes = [node]
+        for event, name, value in self.walk(runtime_module):
+            if event == ENTER:
+                nodes.append(nodes[-1].setdefault(name, {}))
+            elif event == LEAF:
+                nodes[-1][name] = value
+            else:
+                nodes.pop()
+    
+    def get_calls(self, graph, module):
+        """
+        OT: (calls, omitted)
+                calls: array/memoryview. module 的被调用者, 超过最大扇出的部分已被截去.
+                omitted: int. 被截去的数量.
+        """
+        calls = graph.get_callees(module)
+        if self.max_fanout is not None and len(calls) > self.max_fanout:
+            return calls[:self.max_fanout], len(calls) - self.max_fanout
+        return calls, 0
     
-    def recurse(self, node: dict, calls):
+    def walk(self, runtime_module: str):
         """
+        以显式栈代替递归, 按深度优先的顺序展开 runtime_module 的层叠视图, 逐个产出展开
+        的事件. 调用链的深度不受 Python 递归深度的限制, 内存占用只与调用链的深度有关.
+        
+        OT: iter[(event, name, value)]
+                (ENTER, name, None): 进入 name 的子树.
+                (LEAF, name, value): 不再展开的条目. value 为 CALLBACK_HELL,
+                    MAX_DEPTH, {'$ref': pointer}, 或被省略的数量 (此时 name 为
+                    MAX_FANOUT).
+                (EXIT, None, None): 离开当前的子树.
         
         demo:
-            self.tile_views = {
+            self.graph 还原为字符串后为 {
                 'src.app.module': ['src.prechecker.main', 'src.app.main'],
                 'src.prechecker.main': [],
                 'src.app.main': ['src.app.main.child_method']
             }
-            self.cascade_view = {
-                'src.app.module': {}  # <- current node param is pointed to `{}`
+            runtime_module = 'src.app.module'
+            -> (ENTER, 'src.prechecker.main'), (EXIT,),
+               (ENTER, 'src.app.main'),
+                   (ENTER, 'src.app.main.child_method'), (EXIT,),
+               (EXIT,)
+            -> 对应的层叠视图为 {
+                'src.prechecker.main': {},
+                'src.app.main': {'src.app.main.child_method': {}}
             }
-            calls = ['src.prechecker.main', 'src.app.main']
+        
+        同一个 module 在 calls 中出现多次时, 再次展开的结果与首次相同, 因此只展开一次.
+        
+        关于可能出现 "回调地狱" 的情况:
+            假如 self.cascade_view 存在以下情况:
+                {A: {B: {A: {B: {A: {B: {A: ...}}}}}}}
+            说明出现了无限回调.
+            为了避免这种情况, 我们利用 `if module in self.depths` 及时发现无限回调的兆
+            头, 立即停止并标记为不安全的:
+                {A: {B: {A: STOP_AND_MARK_UNSAFE}
+            对于 "回调地狱" 的情况, 将被标记为 CALLBACK_HELL.
+        
+        'dag' 模式下子树能否被共享:
+            每个栈帧记录子树中被截断的回调所指向的最浅的位置 (self.stacks 的下标) low.
+            module 在 self.stacks 中的下标为 d, 若它的子树中的截断都位于 d 之后, 说明
+            module 不在任何 (除自调用以外的) 环上, 它的子树与经由哪条路径到达它无关, 可
+            以被共享. 否则子树中的截断取决于当前的路径, 每次都要重新展开.
+            此外, 子树的层数 height 加上它所在的深度不能超过最大深度, 否则 'tree' 模式
+            在该位置会截断子树.
+        
+        collapse_cycles 为 True 时, 以下的 module 都是指缩点后的分量. 缩点后的图无环,
+        不会出现 CALLBACK_HELL, 'dag' 模式下所有子树都可以被共享.
         """
-        if not calls:
-            return
-        for module in calls:
-            if module in self.stacks:
-                """
-                关于可能出现 "回调地狱" 的情况:
-                    假如 self.cascade_view 存在以下情况:
-                        {A: {B: {A: {B: {A: {B: {A: ...}}}}}}}
-                    说明出现了无限回调.
-                    为了避免这种情况, 我们利用 `if module in self.stacks` 及时发现无限
-                    回调的兆头, 立即停止并标记为不安全的:
-                        {A: {B: {A: STOP_AND_MARK_UNSAFE}
-                    这里就是做这件事的.
-                对于 "回调地狱" 的情况, 将被标记为 '[◆CALLBACK_HELL◆]'.
-                """
-                node.update({module: '[◆CALLBACK_HELL◆]'})
+        dag = self.view_mode == 'dag'
+        max_depth = self.max_depth
+        stacks, depths, refs = self.stacks, self.depths, self.refs
+        
+        module = self.symbols.find(runtime_module)
+        if self.collapse_cycles:
+            graph = self.condense()
+            get_name = self.get_component_name
+            module = graph.get_component(module)
+        else:
+            graph = self.graph
+            get_name = self.symbols.get_name
+        
+        # frame: [seen, calls, next_index, low, height, path_cell]
+        #   seen: {name, ...}. 已产出的条目, 相当于层叠视图中这一层的键.
+        #   height 的初始值: 有被调用者 (包括被省略的) 时为 1, 否则为 0.
+        calls, omitted = self.get_calls(graph, module)
+        frames = [[set(), calls, 0, 0, min(graph.out_degree(module), 1),
+                   (_escape(runtime_module), None)]]
+        if omitted:
+            frames[-1][0].add(MAX_FANOUT)
+            yield LEAF, MAX_FANOUT, omitted
+        
+        while frames:
+            frame = frames[-1]
+            seen, calls, i = frame[0], frame[1], frame[2]
+            
+            if i == len(calls):
+                # 当前 module 的子树已展开完毕, 回到上一层.
+                frames.pop()
+                if not frames:
+                    break
+                yield EXIT, None, None
+                module = stacks.pop()
+                del depths[module]
+                low, height = frame[3], frame[4]
+                if dag and seen and low > len(stacks) and (
+                        max_depth is None or len(stacks) + 1 + height <=
+                        max_depth
+                ):
+                    refs[module] = (frame[5], height)
+                parent = frames[-1]
+                parent[3] = min(parent[3], low)
+                parent[4] = max(parent[4], height + 1)
                 continue
-            else:
-                self.stacks.append(module)
-                # -> module = 'src.prechecker.main'
             
-            new_node = node.setdefault(module, {})
-            new_calls = self.tile_view.get(module)
-            # module = 'src.prechecker.main' -> new_calls = []
-            self.recurse(new_node, new_calls)
+            frame[2] = i + 1
+            module = calls[i]
+            name = get_name(module)
+            if name in seen:
+                continue
+            seen.add(name)
+            depth = len(stacks) + 1  # module 所在的深度
             
-            self.stacks.pop()
-        """TODO
-        demo:
-            node = {}, calls = ['src.prechecker.main', 'src.app.main']
-            -> i1: module = 'src.prechecker.main'
-                -> self.stacks updated: ['src.prechecker.main']
-                -> node updated: {'src.prechecker.main': new_node}
-                    -> new_node = {}
-                -> new_calls = []
-                -> recurse: node = {}, calls = []
-                    -> over
-            -> i2: module = 'src.app.main'
-                -> self.stacks updated: ['src.prechecker.main', 'src.app.main']
-                -> node updated: {'src.app.main': new_node}
-                    -> new_node = {}
-                -> new_calls = ['src.app.main.child_method']
-                -> recurse: node = {}, calls = ['src.app.main.child_method']
-                    -> i1: module = 'src.app.main.child_method'
-                        ->
-        """
+            if module in depths:
+                yield LEAF, name, CALLBACK_HELL
+                if module != stacks[-1]:  # 自调用不影响子树能否被共享
+                    frame[3] = min(frame[3], depths[module])
+                continue
+            if dag:
+                ref = refs.get(module)
+                if ref and (max_depth is None or depth + ref[1] <= max_depth):
+                    if isinstance(ref[0], tuple):
+                        ref = refs[module] = (_join(ref[0]), ref[1])
+                    yield LEAF, name, {'$ref': ref[0]}
+                    frame[4] = max(frame[4], ref[1] + 1)
+                    continue
+            
+            if max_depth is not None and depth >= max_depth:
+                if graph.out_degree(module):
+                    yield LEAF, name, MAX_DEPTH
+                    frame[4] = float('inf')  # 子树被截断, 不能被共享
+                else:
+                    yield ENTER, name, None
+                    yield EXIT, None, None
+                continue
+            
+            stacks.append(module)
+            depths[module] = depth - 1
+            yield ENTER, name, None
+            calls, omitted = self.get_calls(graph, module)
+            frames.append([set(), calls, 0, depth,
+                           min(graph.out_degree(module), 1),
+                           (_escape(name), frame[5])])
+            if omitted:
+                frames[-1][0].add(MAX_FANOUT)
+                yield LEAF, MAX_FANOUT, omitted
+
+
+def _escape(name):
+    # JSON Pointer (RFC 6901) 中的转义.
+    return name.replace('~', '~0').replace('/', '~1')
+
+
+def _join(cell):
+    segs = []
+    while cell:
+        segs.append(cell[0])
+        cell = cell[1]
+    segs.append('#')
+    return '/'.join(reversed(segs))
+
+
+def expand_refs(cascade_view: dict):
+    """
+    把 'dag' 模式的层叠视图中的引用展开, 还原为 'tree' 模式的层叠视图.
+    
+    IN: cascade_view: dict. e.g. {
+            'src.app.module': {
+                'src.app.main': {'src.util.foo': {'src.util.bar': {}}},
+                'src.app.Init': {
+                    'src.util.foo': {
+                        '$ref': '#/src.app.module/src.app.main/src.util.foo'
+                    }
+                }
+            }
+        }
+    OT: dict. e.g. {
+            'src.app.module': {
+                'src.app.main': {'src.util.foo': {'src.util.bar': {}}},
+                'src.app.Init': {'src.util.foo': {'src.util.bar': {}}}
+            }
+        }
+    """
+    
+    def resolve(pointer):
+        node = cascade_view
+        for seg in pointer.split('/')[1:]:
+            node = node[seg.replace('~1', '/').replace('~0', '~')]
+        return node
+    
+    # 以显式栈代替递归, 使很深的调用链也能被展开.
+    out = {}
+    stack = [(cascade_view, out)]
+    while stack:
+        src, dst = stack.pop()
+        for k, v in src.items():
+            while isinstance(v, dict) and '$ref' in v:
+                v = resolve(v['$ref'])
+            if isinstance(v, dict):
+                dst[k] = {}
+                stack.append((v, dst[k]))
+            else:  # CALLBACK_HELL, MAX_DEPTH 等标记
+                dst[k] = v
+    return out
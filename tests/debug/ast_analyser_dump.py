@@ -13,8 +13,7 @@ def main():
     ifile = '../../temp/in.py'
     ofile = 'ast_analyser_dump.json'
     analyser = AstAnalyser(ifile)
-    ast_tree = analyser.main()
-    ast_indents = analyser.get_lino_indent_dict()
+    ast_tree, ast_indents = analyser.main().to_dicts()
     
     out = ast_tree
     for lino, ast_data in ast_tree.items():
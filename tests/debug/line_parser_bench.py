@@ -0,0 +1,222 @@
+"""
+LineParser 的微基准测试: 比较改为行程序之前的 LineParser (按节点类型分发到 parse_* 方
+法, 每次解析都做字符串切分, see BaselineLineParser) 与执行预先编译好的行程序的耗时.
+
+BaselineLineParser 是改动之前的 src.line_parser.LineParser#main() 的副本, 只去掉了
+其中的 lk.logt() 调试输出, 因此测得的加速比只来自分发和字符串切分, 不包括日志的开销.
+
+usage: 在本目录下运行 `python line_parser_bench.py [pyfile]`, pyfile 默认为 src
+    /module_analyser.py.
+"""
+import sys
+from timeit import repeat
+
+from src.ast_analyser import ARG, ASSIGN, ATTRIBUTE, AstAnalyser, CALL, \
+    CLASS_DEF, FUNCTION_DEF, IMPORT, IMPORT_FROM, compile_line
+from src.line_parser import LineParser
+
+MASTER_MODULE = 'src.module_analyser.ModuleAnalyser'  # 'self' 所指向的 module
+
+
+class BaselineVarsHolder:
+    """
+    改动之前的 src.line_parser.VarsHolder (只保留 LineParser 用到的方法).
+    """
+    
+    def __init__(self):
+        self.global_vars = {}
+        self.frames = []
+        self.vars = {}
+        self.cache = {}
+    
+    def update(self, var, module):
+        self.vars.update({var: module})
+    
+    def get(self, var):
+        if var in self.vars:
+            return self.vars[var]
+        try:
+            return self.cache[var]
+        except KeyError:
+            pass
+        
+        module = None
+        for frame in reversed(self.frames):
+            if var in frame:
+                module = frame[var]
+                break
+        else:
+            if var in self.global_vars:
+                module = self.global_vars[var]
+        self.cache[var] = module
+        return module
+    
+    def reset(self, frames=()):
+        self.frames = list(frames)
+        self.vars = {}
+        self.cache.clear()
+
+
+class BaselineLineParser:
+    """
+    改动之前的 src.line_parser.LineParser: 逐个节点按类型分发到 parse_* 方法.
+    """
+    
+    def __init__(self, top_module):
+        self.top_module = top_module
+        self.vars_holder = BaselineVarsHolder()
+        
+        self.support_methods = {
+            ARG         : self.parse_arg,
+            ASSIGN      : self.parse_assign,
+            ATTRIBUTE   : self.parse_attribute,
+            CALL        : self.parse_call,
+            CLASS_DEF   : self.parse_class_def,
+            FUNCTION_DEF: self.parse_function_def,
+            IMPORT      : self.parse_import,
+            IMPORT_FROM : self.parse_import,
+        }
+    
+    def reset(self, var_reachables, master_module):
+        if master_module:
+            self.vars_holder.reset(({'self': master_module},) + var_reachables)
+        else:
+            self.vars_holder.reset(var_reachables)
+    
+    def main(self, ast_line):
+        out = []
+        for i in ast_line:
+            obj_kind, obj_val = i[0], i[1]
+            method = self.support_methods.get(obj_kind, self.do_nothing)
+            res = method(obj_val)
+            if res:
+                if isinstance(res, list):
+                    out.extend(res)
+                else:
+                    out.append(res)
+        return out
+    
+    @staticmethod
+    def do_nothing(data):
+        pass
+    
+    def parse_arg(self, arg):
+        module = self.vars_holder.get(arg)
+        if module is None:
+            module = f'<{arg}>'
+        self.vars_holder.update(arg, module)
+        return module
+    
+    def parse_assign(self, assign: dict):
+        out = []
+        for new_var, known_var in assign.items():
+            if known_var.startswith('self.'):
+                module = known_var.replace(
+                    'self', self.vars_holder.get('self'), 1
+                )
+            else:
+                module = self.vars_holder.get(known_var.split('.', 1)[0])
+            if module is None:
+                continue
+            else:
+                out.append(module)
+                self.vars_holder.update(new_var, module)
+        return out
+    
+    def parse_attribute(self, call: str) -> str:
+        if call.startswith('self.'):
+            module = call.replace(
+                'self', self.vars_holder.get('self'), 1
+            )
+        else:
+            if '.' in call:
+                head, tail = call.split('.', 1)
+            else:
+                head, tail = call, ''
+            module = self.vars_holder.get(head)
+            
+            if module is None:
+                return ''
+            else:
+                if tail:
+                    module += '.' + tail
+        return module
+    
+    def parse_call(self, call: str):
+        if '.' in call:
+            head, tail = call.split('.', 1)
+        else:
+            head, tail = call, ''
+        
+        module = self.vars_holder.get(head)
+        
+        if module is None:
+            return ''
+        else:
+            if tail:
+                module += '.' + tail
+            return module
+    
+    def parse_class_def(self, data: str):
+        module = self.top_module + '.' + data
+        self.vars_holder.update(data, module)
+    
+    def parse_function_def(self, data: str):
+        module = self.top_module + '.' + data
+        self.vars_holder.update(data, module)
+    
+    def parse_import(self, data: dict):
+        for module, var in data.items():
+            self.vars_holder.update(var, module)
+
+
+def main(ifile='../../src/module_analyser.py', number=20):
+    ast_table = AstAnalyser(ifile).main()
+    
+    ast_lines = [ast_table.get_line(lino) for lino in ast_table.linos]
+    programs = [ast_table.get_program(lino) for lino in ast_table.linos]
+    
+    baseline = BaselineLineParser('src.module_analyser')
+    line_parser = LineParser('src.module_analyser')
+    baseline.reset((), MASTER_MODULE)
+    line_parser.reset((), MASTER_MODULE)
+    # 先执行一遍, 使两者的 vars_holder 中有相同的变量, 并检查输出是否一致.
+    for ast_line, program in zip(ast_lines, programs):
+        assert baseline.main(ast_line) == line_parser.run(program), ast_line
+    
+    def run_baseline():
+        for x in ast_lines:
+            baseline.main(x)
+    
+    def run_programs():
+        for x in programs:
+            line_parser.run(x)
+    
+    def compile_only():
+        for x in ast_lines:
+            compile_line(x)
+    
+    print('pyfile: {}, lines: {}, nodes: {}, instructions: {}'.format(
+        ifile, len(ast_lines), len(ast_table.kinds),
+        sum(len(x) for x in programs)
+    ))
+    
+    results = {}
+    for name, func in (
+            ('baseline (dispatch)', run_baseline),
+            ('run (precompiled)', run_programs),
+            ('compile only', compile_only),
+    ):
+        results[name] = min(repeat(func, number=number, repeat=5)) / number
+        print('{:<20}{:>10.3f} ms/pass'.format(name, results[name] * 1000))
+    
+    print('speedup: {:.2f}x'.format(
+        results['baseline (dispatch)'] / results['run (precompiled)']
+    ))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(sys.argv[1])
+    else:
+        main()
@@ -9,15 +9,14 @@ def main():
     ofile = 'module_linos_dump.json'
     
     ast_ana = AstAnalyser(ifile)
-    ast_tree = ast_ana.main()
-    ast_indents = ast_ana.get_lino_indent_dict()
+    ast_table = ast_ana.main()
     
     # mod_hlp: module helper
     mod_hlp = ModuleHelper('../../')
     mod_hlp.bind_file(ifile)
     
     # mod_idx: module index
-    mod_idx = ModuleIndexing(mod_hlp, ast_tree, ast_indents)
+    mod_idx = ModuleIndexing(mod_hlp, ast_table)
     
     out = mod_idx.indexing_module_linos()
     